@@ -1,13 +1,15 @@
 import logging
-import json
-import os
+import orjson
 import asyncio
+import time
 from datetime import datetime, timezone, timedelta
+from io import BytesIO
+from typing import Dict, List
 
 from aiogram import Bot, F
 from aiogram.types import (
     Message,
-    FSInputFile,
+    BufferedInputFile,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     CallbackQuery,
@@ -16,9 +18,11 @@ from aiogram.enums import ParseMode
 from aiogram.filters import Command
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
-from aiogram.exceptions import TelegramForbiddenError, TelegramNotFound
+from aiogram.exceptions import TelegramForbiddenError, TelegramNotFound, TelegramRetryAfter
 
 from keyboards import admin_keyboard
+from helpers import notify_trigger
+from ratelimit import bulk_send_bucket
 
 from zoneinfo import ZoneInfo  
 
@@ -26,6 +30,11 @@ logger = logging.getLogger(__name__)
 
 TASHKENT_TZ = ZoneInfo("Asia/Tashkent")
 REMOVE_BLOCK_DAYS = 3
+BROADCAST_WORKERS = 25
+BROADCAST_MAX_RETRIES = 3
+PROGRESS_MIN_STEP = 5
+PROGRESS_MIN_INTERVAL = 2.0
+STATS_CACHE_TTL = 60
 
 
 class PMStates(StatesGroup):
@@ -49,6 +58,16 @@ class ReportStates(StatesGroup):
     waiting_for_report_message = State()
 
 
+_broadcast_tasks = set()
+_stats_cache = {"text": None, "expires": 0.0}
+
+
+def _broadcast_done(task: asyncio.Task) -> None:
+    _broadcast_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Broadcast task failed: {task.exception()}")
+
+
 def format_dt(dt: datetime) -> str:
     """Format datetime to Asia/Tashkent human-friendly string. Accepts tz-aware or naive (assumed UTC)."""
     if dt is None:
@@ -71,22 +90,25 @@ def register_admin_handlers(dp, bot: Bot, database_module):
     database_module should implement:
       - is_admin(user_id) -> bool
       - is_superadmin(user_id) -> bool
+      - get_admin_flags_cached(user_id) -> (is_admin, is_superadmin)
       - get_admins() -> list[dict(user_id, username, created_at)]
       - get_admin_meta(user_id) -> dict or None
       - add_admin(user_id, username=None)
       - remove_admin(user_id)
-      - get_all_users()
+      - get_users_count()
+      - iter_active_user_ids() -> async iterator of user id pages
+      - iter_active_users() -> async iterator of user records (server-side cursor)
       - deactivate_user(user_id)
+      - deactivate_users(user_ids)
       - log_admin_action(admin_id, action, target_user_id=None, details=None)
       - get_superadmin_id() -> Optional[int]
-      - pool (asyncpg pool) for raw queries when needed
+      - get_pool() -> asyncpg pool for raw queries when needed
     """
 
     async def require_admin_or_deny(message: Message) -> bool:
         try:
-            if await database_module.is_admin(message.from_user.id):
-                return True
-            if await database_module.is_superadmin(message.from_user.id):
+            admin_flag, super_flag = await database_module.get_admin_flags_cached(message.from_user.id)
+            if admin_flag or super_flag:
                 return True
             await message.answer("❌ Bu buyruq faqat admin uchun.")
             return False
@@ -116,33 +138,92 @@ def register_admin_handlers(dp, bot: Bot, database_module):
             await message.answer("❗ Xabar bo'sh. Iltimos matn yozing.")
             return
 
-        user_records = await database_module.get_all_users()
-        success, fail = 0, 0
+        await state.clear()
         progress_message = await message.answer("📤 Xabar yuborilmoqda: 0%")
-
-        total = len(user_records) if user_records else 0
-        for i, record in enumerate(user_records, 1):
-            user_id = record['user_id']
+        # Yuborish fonda davom etadi — handler darhol qaytadi, dispatcher band bo'lmaydi
+        task = asyncio.create_task(run_broadcast(progress_message, text_to_send))
+        _broadcast_tasks.add(task)
+        task.add_done_callback(_broadcast_done)
+
+    async def run_broadcast(progress_message: Message, text_to_send: str):
+        total = await database_module.get_users_count()
+        success, fail, done = 0, 0, 0
+        last_percent = 0
+        last_edit = time.monotonic()
+        edit_suppress_until = 0.0
+
+        queue: "asyncio.Queue[int]" = asyncio.Queue()
+
+        retries: Dict[int, int] = {}
+        dead: List[int] = []
+
+        async def send_one(user_id: int):
+            nonlocal success, fail, done, last_percent, last_edit, edit_suppress_until
+            await bulk_send_bucket.acquire()
             try:
                 await bot.send_message(user_id, text_to_send)
                 success += 1
+            except TelegramRetryAfter as e:
+                bulk_send_bucket.penalize(e.retry_after + 0.5)
+                attempts = retries.get(user_id, 0) + 1
+                if attempts <= BROADCAST_MAX_RETRIES:
+                    retries[user_id] = attempts
+                    queue.put_nowait(user_id)
+                    return
+                logger.warning(f"⚠️ Flood limit: {user_id} ga {attempts - 1} urinishdan keyin yuborilmadi")
+                fail += 1
             except (TelegramForbiddenError, TelegramNotFound):
                 logger.warning(f"❌ Foydalanuvchi topilmadi yoki bloklangan: {user_id}")
-                try:
-                    await database_module.deactivate_user(user_id)
-                except Exception:
-                    logger.exception("DB deactivate error")
+                dead.append(user_id)
                 fail += 1
             except Exception as e:
                 logger.warning(f"⚠️ Xatolik: {user_id} - {e}")
                 fail += 1
 
-            percent = int(i / total * 100) if total else 100
+            done += 1
+            percent = min(int(done / max(total, 1) * 100), 100)
+            if percent <= last_percent:
+                return
+            # Progress har 5% yoki 2 s da bir marta tahrirlanadi (chatga ~1 edit/s limit)
+            now = time.monotonic()
+            if now < edit_suppress_until:
+                return
+            if percent - last_percent < PROGRESS_MIN_STEP and now - last_edit < PROGRESS_MIN_INTERVAL:
+                return
+            last_percent, last_edit = percent, now
             try:
                 await progress_message.edit_text(f"📤 Xabar yuborilmoqda: {percent}%")
+            except TelegramRetryAfter as e:
+                edit_suppress_until = now + e.retry_after
             except Exception:
                 pass
-            await asyncio.sleep(0.05)
+
+        async def worker():
+            while True:
+                try:
+                    user_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await send_one(user_id)
+
+        # Userlar sahifalab o'qiladi: butun ro'yxat xotiraga yuklanmaydi
+        async for page in database_module.iter_active_user_ids():
+            for user_id in page:
+                queue.put_nowait(user_id)
+            results = await asyncio.gather(
+                *(worker() for _ in range(min(BROADCAST_WORKERS, len(page)))),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Broadcast worker failed: {result}")
+            # Bloklaganlar har sahifa oxirida bitta UPDATE bilan o'chiriladi
+            if dead:
+                try:
+                    await database_module.deactivate_users(dead)
+                except Exception:
+                    logger.exception("DB deactivate error")
+                dead.clear()
 
         try:
             await progress_message.edit_text(
@@ -151,7 +232,6 @@ def register_admin_handlers(dp, bot: Bot, database_module):
             )
         except Exception:
             pass
-        await state.clear()
 
     async def cmd_pm(message: Message, state: FSMContext):
         if not await require_admin_or_deny(message):
@@ -173,7 +253,8 @@ def register_admin_handlers(dp, bot: Bot, database_module):
             if hasattr(database_module, "get_user_by_identifier"):
                 user_id = await database_module.get_user_by_identifier(identifier)
             else:
-                async with database_module.pool.acquire() as conn:
+                db = await database_module.get_pool()
+                async with db.acquire() as conn:
                     if identifier.startswith("@"):
                         user_id = await conn.fetchval(
                             "SELECT user_id FROM users WHERE username = $1",
@@ -235,7 +316,8 @@ def register_admin_handlers(dp, bot: Bot, database_module):
             return
 
         try:
-            async with database_module.pool.acquire() as conn:
+            db = await database_module.get_pool()
+            async with db.acquire() as conn:
                 two_weeks_top = await conn.fetch('''
                     SELECT user_id, username, COUNT(*) as activity_count
                     FROM user_activity
@@ -287,50 +369,73 @@ def register_admin_handlers(dp, bot: Bot, database_module):
         if not await require_admin_or_deny(message):
             return
 
-        try:
-            async with database_module.pool.acquire() as conn:
-                total_users = await conn.fetchval('''
-                    SELECT COUNT(*) FROM users
-                    WHERE is_active = TRUE
-                      AND user_id NOT IN (SELECT user_id FROM admins)
-                      AND user_id NOT IN (SELECT user_id FROM superadmins)
-                ''')
+        # Tez-tez bosilganda oldingi natija qayta ishlatiladi
+        if _stats_cache["text"] and time.monotonic() < _stats_cache["expires"]:
+            await message.answer(_stats_cache["text"], parse_mode="HTML")
+            return
 
-                most_active_30days = await conn.fetchrow('''
+        try:
+            # Bitta so'rov — bitta round-trip (avval to'rtta alohida so'rov edi)
+            db = await database_module.get_pool()
+            row = await db.fetchrow('''
+                WITH staff AS (
+                    SELECT user_id FROM admins
+                    UNION
+                    SELECT user_id FROM superadmins
+                )
+                SELECT
+                    (SELECT COUNT(*) FROM users
+                     WHERE is_active = TRUE
+                       AND user_id NOT IN (SELECT user_id FROM staff)) AS total_users,
+                    m30.user_id AS m30_user_id, m30.username AS m30_username, m30.activity_count AS m30_count,
+                    td.user_id  AS td_user_id,  td.username  AS td_username,  td.activity_count  AS td_count,
+                    lu.user_id  AS lu_user_id,  lu.username  AS lu_username,  lu.created_at      AS lu_created_at
+                FROM (SELECT 1) AS one
+                LEFT JOIN LATERAL (
                     SELECT user_id, username, COUNT(*) AS activity_count
                     FROM user_activity
                     WHERE activity_time >= NOW() - INTERVAL '30 days'
-                      AND user_id NOT IN (SELECT user_id FROM admins)
-                      AND user_id NOT IN (SELECT user_id FROM superadmins)
+                      AND user_id NOT IN (SELECT user_id FROM staff)
                     GROUP BY user_id, username
                     ORDER BY activity_count DESC
                     LIMIT 1
-                ''')
-
-                most_active_today = await conn.fetchrow('''
+                ) AS m30 ON TRUE
+                LEFT JOIN LATERAL (
                     SELECT user_id, username, COUNT(*) AS activity_count
                     FROM user_activity
                     WHERE activity_time >= CURRENT_DATE
-                      AND user_id NOT IN (SELECT user_id FROM admins)
-                      AND user_id NOT IN (SELECT user_id FROM superadmins)
+                      AND user_id NOT IN (SELECT user_id FROM staff)
                     GROUP BY user_id, username
                     ORDER BY activity_count DESC
                     LIMIT 1
-                ''')
-
-                last_user = await conn.fetchrow('''
+                ) AS td ON TRUE
+                LEFT JOIN LATERAL (
                     SELECT user_id, username, created_at
                     FROM users
-                    WHERE user_id NOT IN (SELECT user_id FROM admins)
-                      AND user_id NOT IN (SELECT user_id FROM superadmins)
+                    WHERE user_id NOT IN (SELECT user_id FROM staff)
                     ORDER BY created_at DESC
                     LIMIT 1
-                ''')
+                ) AS lu ON TRUE
+            ''')
         except Exception:
             logger.exception("handle_users_command error")
             await message.answer("❌ DB xatosi.")
             return
 
+        total_users = row['total_users']
+        most_active_30days = (
+            {'user_id': row['m30_user_id'], 'username': row['m30_username'], 'activity_count': row['m30_count']}
+            if row['m30_user_id'] is not None else None
+        )
+        most_active_today = (
+            {'user_id': row['td_user_id'], 'username': row['td_username'], 'activity_count': row['td_count']}
+            if row['td_user_id'] is not None else None
+        )
+        last_user = (
+            {'user_id': row['lu_user_id'], 'username': row['lu_username'], 'created_at': row['lu_created_at']}
+            if row['lu_user_id'] is not None else None
+        )
+
         def format_user(user):
             if not user:
                 return "—"
@@ -356,23 +461,35 @@ def register_admin_handlers(dp, bot: Bot, database_module):
             f"├ 👤 {format_user(last_user)}\n"
             f"└ 📅 Qo'shilgan: {last_created_str}"
         )
+        _stats_cache["text"] = text
+        _stats_cache["expires"] = time.monotonic() + STATS_CACHE_TTL
         await message.answer(text, parse_mode="HTML")
 
+    async def handle_notify_inactive_now(message: Message):
+        if not await require_admin_or_deny(message):
+            return
+        notify_trigger.set()
+        await message.answer("🔔 Nofaol foydalanuvchilarga eslatma yuborish boshlandi.")
+
     async def handle_dump_users(message: Message):
         if not await require_admin_or_deny(message):
             return
         try:
-            users = await database_module.get_all_users()
-            temp_file = "temp_users.json"
-            with open(temp_file, "w", encoding="utf-8") as f:
-                json.dump([dict(user) for user in users], f, indent=4, ensure_ascii=False)
-
-            file_to_send = FSInputFile(temp_file)
+            # NDJSON: har qator alohida — ro'yxat va dict lar xotirada to'planmaydi
+            buf = BytesIO()
+            async for r in database_module.iter_active_users():
+                buf.write(orjson.dumps({
+                    'user_id': r['user_id'],
+                    'username': r['username'],
+                    'created_at': r['created_at'],
+                    'last_seen': r['last_seen'],
+                }, option=orjson.OPT_APPEND_NEWLINE))
+            file_to_send = BufferedInputFile(buf.getvalue(), filename="users.ndjson")
+            buf = None
             await message.answer_document(file_to_send, caption="📄 Foydalanuvchilar ro'yxati")
-            os.remove(temp_file)
         except Exception:
             logger.exception("handle_dump_users error")
-            await message.answer(f"❌ Xatolik yuz berdi: server yoki fayl tizimi")
+            await message.answer(f"❌ Xatolik yuz berdi: server xatosi")
 
     async def start_add_admin(message: Message, state: FSMContext):
         if not await require_admin_or_deny(message):
@@ -394,8 +511,8 @@ def register_admin_handlers(dp, bot: Bot, database_module):
 
         username = None
         try:
-            async with database_module.pool.acquire() as conn:
-                username = await conn.fetchval('SELECT username FROM users WHERE user_id = $1', new_admin_id)
+            db = await database_module.get_pool()
+            username = await db.fetchval('SELECT username FROM users WHERE user_id = $1', new_admin_id)
         except Exception:
             logger.exception("DB error while fetching username for new admin")
 
@@ -462,8 +579,8 @@ def register_admin_handlers(dp, bot: Bot, database_module):
 
             requester_created_at = None
             try:
-                async with database_module.pool.acquire() as conn:
-                    requester_created_at = await conn.fetchval('SELECT created_at FROM admins WHERE user_id = $1', requester_id)
+                db = await database_module.get_pool()
+                requester_created_at = await db.fetchval('SELECT created_at FROM admins WHERE user_id = $1', requester_id)
             except Exception:
                 logger.exception("DB error fetching requester created_at")
 
@@ -562,8 +679,8 @@ def register_admin_handlers(dp, bot: Bot, database_module):
 
             requester_created_at = None
             try:
-                async with database_module.pool.acquire() as conn:
-                    requester_created_at = await conn.fetchval('SELECT created_at FROM admins WHERE user_id = $1', requester)
+                db = await database_module.get_pool()
+                requester_created_at = await db.fetchval('SELECT created_at FROM admins WHERE user_id = $1', requester)
             except Exception:
                 logger.exception("DB error fetching requester created_at")
 
@@ -722,13 +839,13 @@ def register_admin_handlers(dp, bot: Bot, database_module):
                 await message.answer("❌ Afsus, xabaringizni adminga yuborib bo'lmadi. Iltimos keyinroq urinib ko'ring.")
 
             try:
-                await database_module.log_admin_action(None, "user_report", None, json.dumps({
+                await database_module.log_admin_action(None, "user_report", None, orjson.dumps({
                     "reporter_id": reporter.id,
                     "reported_chat_id": reported_chat_id,
                     "text": report_text,
                     "sent_to": sent_to,
                     "failed": failed_to,
-                }, ensure_ascii=False))
+                }).decode())
             except Exception:
                 logger.exception("log_admin_action (report) failed")
         except Exception:
@@ -745,6 +862,7 @@ def register_admin_handlers(dp, bot: Bot, database_module):
     dp.message.register(handle_top, F.text == '🏆 Faol foydalanuvchilar')
     dp.message.register(handle_users_command, F.text == '📊 Statistika')
     dp.message.register(handle_dump_users, F.text == "📄 Userlar ro'yxati")
+    dp.message.register(handle_notify_inactive_now, Command("notify_inactive_now"))
     dp.message.register(start_add_admin, F.text == "➕ Admin qo'shish")
     dp.message.register(start_remove_admin, F.text == "➖ Admin o'chirish")
     dp.message.register(process_broadcast, BroadcastStates.waiting_for_broadcast_text)
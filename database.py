@@ -1,12 +1,16 @@
 import os
+import time
 import asyncio
+import logging
 import asyncpg
+from collections import OrderedDict
 from dotenv import load_dotenv
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Set, AsyncIterator
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo  
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 pool: Optional[asyncpg.pool.Pool] = None
@@ -14,6 +18,42 @@ _pool_lock = asyncio.Lock()
 
 TASHKENT_TZ = ZoneInfo("Asia/Tashkent")
 
+# Sized for broadcast workers + flushers + user traffic running together; override via env.
+# asyncpg prepares each distinct query once per connection via the statement cache,
+# so the hot INSERT/UPSERT/admin-snapshot statements are never re-parsed server-side.
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN", "5"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX", "25"))
+POOL_MAX_INACTIVE_LIFETIME = 300
+POOL_STATEMENT_CACHE_SIZE = 1024
+POOL_MAX_CACHED_STATEMENT_LIFETIME = 0
+POOL_COMMAND_TIMEOUT = 30
+
+ACTIVITY_FLUSH_INTERVAL = 0.5
+ACTIVITY_FLUSH_ROWS = 100
+ACTIVITY_QUEUE_SIZE = 10000
+ACTIVITY_FALLBACK_MAX = 100
+USER_SEEN_FLUSH_INTERVAL = 30
+KNOWN_USERS_CACHE_SIZE = 100000
+USER_ID_PAGE_SIZE = 5000
+_activity_queue: "asyncio.Queue[Tuple[int, Optional[str], str]]" = asyncio.Queue(ACTIVITY_QUEUE_SIZE)
+# user_id -> latest non-null username; last_seen is written by user_seen_flusher()
+_pending_users: Dict[int, Optional[str]] = {}
+# users already confirmed to exist in the users table (LRU)
+_known_users: "OrderedDict[int, None]" = OrderedDict()
+# direct writes started while the queue was full (bounded by ACTIVITY_FALLBACK_MAX)
+_fallback_writes: Set[asyncio.Task] = set()
+# batch the flusher had already dequeued when it was cancelled
+_interrupted_rows: List[Tuple[int, Optional[str], str]] = []
+
+ADMIN_CACHE_TTL = 60
+# after a failed reload, keep serving the old snapshot this long before the next attempt
+ADMIN_CACHE_RETRY = 5
+# snapshot of the (tiny) admin/superadmin tables, reloaded every ADMIN_CACHE_TTL seconds
+_admin_ids: Set[int] = set()
+_superadmin_ids: Set[int] = set()
+_admin_ids_expires = 0.0
+_admin_ids_lock = asyncio.Lock()
+
 
 async def create_db_pool():
     """Create and return a global asyncpg pool (if not created yet)."""
@@ -23,9 +63,23 @@ async def create_db_pool():
             if pool is None:
                 if not DATABASE_URL:
                     raise RuntimeError("DATABASE_URL is not set in environment")
-                pool = await asyncpg.create_pool(DATABASE_URL)
+                pool = await asyncpg.create_pool(
+                    DATABASE_URL,
+                    min_size=POOL_MIN_SIZE,
+                    max_size=POOL_MAX_SIZE,
+                    max_inactive_connection_lifetime=POOL_MAX_INACTIVE_LIFETIME,
+                    statement_cache_size=POOL_STATEMENT_CACHE_SIZE,
+                    max_cached_statement_lifetime=POOL_MAX_CACHED_STATEMENT_LIFETIME,
+                    command_timeout=POOL_COMMAND_TIMEOUT,
+                )
     return pool
 
+async def get_pool() -> asyncpg.pool.Pool:
+    """Return the global pool, creating it on first use."""
+    if pool is not None:
+        return pool
+    return await create_db_pool()
+
 async def close_db_pool():
     """Close the global pool (use on shutdown)."""
     global pool
@@ -41,10 +95,8 @@ async def create_users_table():
     Create required tables if they do not exist.
     Uses TIMESTAMPTZ for timezone-aware timestamps.
     """
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
+    db = await get_pool()
+    async with db.acquire() as conn:
         await conn.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 user_id BIGINT PRIMARY KEY,
@@ -87,42 +139,164 @@ async def create_users_table():
         ''')
         try:
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_is_active ON users(is_active);")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_activity_time ON user_activity(activity_time);")
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_activity_user ON user_activity(user_id);")
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_inactive ON users(last_seen) WHERE is_active;")
+            # covers the time-window top-user aggregations (user_id, username) as index-only scans;
+            # its activity_time prefix replaces the old single-column index
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_activity_time_covering ON user_activity(activity_time, user_id) INCLUDE (username);")
+            await conn.execute("DROP INDEX IF EXISTS idx_activity_time_user;")
+            await conn.execute("DROP INDEX IF EXISTS idx_activity_time;")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at DESC);")
         except Exception:
             pass
 
 
-async def save_user(user_id: int, username: Optional[str] = None) -> None:
+def log_user_activity(user_id: int, username: Optional[str], activity_type: str) -> None:
     """
-    Save or update user. If username is None, keep existing username.
-    Always update last_seen to NOW() and set is_active = TRUE.
+    Non-blocking: records the user and the activity row for message handlers.
+    Rows are written in batches by activity_flusher(). If the queue is full,
+    the row is written directly in the background; once ACTIVITY_FALLBACK_MAX
+    such writes are in flight (DB stalled) it is dropped rather than piling up.
     """
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        await conn.execute('''
+    row = (user_id, username, activity_type)
+    try:
+        _activity_queue.put_nowait(row)
+        return
+    except asyncio.QueueFull:
+        pass
+    if len(_fallback_writes) >= ACTIVITY_FALLBACK_MAX:
+        logger.warning("Activity queue full, dropping %s for user %s", activity_type, user_id)
+        return
+    task = asyncio.create_task(_write_activity([row]))
+    _fallback_writes.add(task)
+    task.add_done_callback(_fallback_done)
+
+
+def _fallback_done(task: "asyncio.Task") -> None:
+    _fallback_writes.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Direct activity write error: {task.exception()}")
+
+
+def _merge_users(target: Dict[int, Optional[str]], users: Dict[int, Optional[str]]) -> None:
+    for user_id, username in users.items():
+        target[user_id] = username if username is not None else target.get(user_id)
+
+
+async def _write_activity(rows: List[Tuple[int, Optional[str], str]]) -> None:
+    """
+    Insert activity rows. New users are created in the same statement through a
+    writable CTE (user_activity has an FK on users, checked at statement end);
+    last_seen/username refreshes are deferred to user_seen_flusher().
+    """
+    users: Dict[int, Optional[str]] = {}
+    for user_id, username, _ in rows:
+        users[user_id] = username if username is not None else users.get(user_id)
+
+    new_users = [user_id for user_id in users if user_id not in _known_users]
+
+    db = await get_pool()
+    await db.execute('''
+        WITH new_users AS (
             INSERT INTO users (user_id, username, last_seen)
-            VALUES ($1, $2, NOW())
-            ON CONFLICT (user_id)
-            DO UPDATE SET
-                username = COALESCE(EXCLUDED.username, users.username),
+            SELECT user_id, username, NOW()
+            FROM unnest($4::bigint[], $5::varchar[]) AS n(user_id, username)
+            ON CONFLICT (user_id) DO NOTHING
+        )
+        INSERT INTO user_activity (user_id, username, activity_type)
+        SELECT user_id, username, activity_type
+        FROM unnest($1::bigint[], $2::varchar[], $3::varchar[]) AS a(user_id, username, activity_type)
+    ''',
+        [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows],
+        new_users, [users[user_id] for user_id in new_users],
+    )
+    _merge_users(_pending_users, users)
+    for user_id in users:
+        _known_users[user_id] = None
+        _known_users.move_to_end(user_id)
+    while len(_known_users) > KNOWN_USERS_CACHE_SIZE:
+        _known_users.popitem(last=False)
+
+
+async def _write_users_seen(users: Dict[int, Optional[str]]) -> None:
+    db = await get_pool()
+    async with db.acquire() as conn:
+        await conn.executemany('''
+            UPDATE users SET
+                username = COALESCE($2, username),
                 last_seen = NOW(),
                 is_active = TRUE
-        ''', user_id, username)
+            WHERE user_id = $1
+        ''', list(users.items()))
 
 
-async def log_user_activity(user_id: int, username: Optional[str], activity_type: str) -> None:
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO user_activity (user_id, username, activity_type)
-            VALUES ($1, $2, $3)
-        ''', user_id, username, activity_type)
+async def flush_users_seen() -> None:
+    """Write accumulated last_seen/username refreshes in one batch."""
+    global _pending_users
+    if not _pending_users:
+        return
+    users, _pending_users = _pending_users, {}
+    try:
+        await _write_users_seen(users)
+    except Exception:
+        # keep them for the next round; newer usernames win
+        _merge_users(users, _pending_users)
+        _pending_users = users
+        raise
+
+
+async def user_seen_flusher() -> None:
+    """Background task: refresh users.last_seen every USER_SEEN_FLUSH_INTERVAL seconds."""
+    while True:
+        await asyncio.sleep(USER_SEEN_FLUSH_INTERVAL)
+        try:
+            await flush_users_seen()
+        except Exception as e:
+            logger.error(f"last_seen flush error: {e}")
+
+
+async def activity_flusher() -> None:
+    """
+    Background task: drain queued activity every ACTIVITY_FLUSH_INTERVAL seconds
+    or ACTIVITY_FLUSH_ROWS rows, whichever comes first.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        rows = [await _activity_queue.get()]
+        try:
+            deadline = loop.time() + ACTIVITY_FLUSH_INTERVAL
+            while len(rows) < ACTIVITY_FLUSH_ROWS:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    rows.append(await asyncio.wait_for(_activity_queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+            await _write_activity(rows)
+        except asyncio.CancelledError:
+            # shutdown: hand the batch already taken off the queue to flush_activity_queue()
+            _interrupted_rows.extend(rows)
+            raise
+        except Exception as e:
+            logger.error(f"Activity flush error ({len(rows)} rows): {e}")
+
+
+async def flush_activity_queue() -> None:
+    """
+    Write whatever is still pending (use on shutdown, after cancelling activity_flusher):
+    the interrupted batch, queued rows and in-flight direct writes.
+    """
+    rows = list(_interrupted_rows)
+    _interrupted_rows.clear()
+    while not _activity_queue.empty():
+        rows.append(_activity_queue.get_nowait())
+    if rows:
+        await _write_activity(rows)
+    if _fallback_writes:
+        await asyncio.gather(*_fallback_writes, return_exceptions=True)
+    await flush_users_seen()
 
 
 def format_dt_for_tashkent(dt: Optional[datetime]) -> Optional[str]:
@@ -143,75 +317,76 @@ def format_dt_for_tashkent(dt: Optional[datetime]) -> Optional[str]:
     return dt_tashkent.strftime("%Y-%m-%d %H:%M:%S") + " Asia/Tashkent"
 
 
-async def get_all_users() -> List[Dict[str, Any]]:
+async def iter_active_users(prefetch: int = USER_ID_PAGE_SIZE) -> AsyncIterator[asyncpg.Record]:
     """
-    Return all active users with basic metadata.
-    Includes both raw datetimes and formatted strings for display.
+    Yield active users one record at a time from a server-side cursor.
+    Rows are fetched `prefetch` at a time; the whole table is never materialized.
     """
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch('''
-            SELECT user_id, username, created_at, last_seen
-            FROM users
-            WHERE is_active = TRUE
+    db = await get_pool()
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            async for record in conn.cursor('''
+                SELECT user_id, username, created_at, last_seen
+                FROM users
+                WHERE is_active = TRUE
+                ORDER BY user_id
+            ''', prefetch=prefetch):
+                yield record
+
+
+async def iter_active_user_ids(page_size: int = USER_ID_PAGE_SIZE) -> AsyncIterator[List[int]]:
+    """
+    Yield active user ids in keyset-paginated pages.
+    Only one page is held in memory and no connection is kept between pages.
+    """
+    db = await get_pool()
+    last_id = 0
+    while True:
+        rows = await db.fetch('''
+            SELECT user_id FROM users
+            WHERE is_active = TRUE AND user_id > $1
             ORDER BY user_id
-        ''')
-        result = []
-        for r in rows:
-            created_raw = r.get('created_at')
-            last_raw = r.get('last_seen')
-            result.append({
-                'user_id': r['user_id'],
-                'username': r.get('username'),
-                'display_name': f"@{r.get('username')}" if r.get('username') else f"ID:{r['user_id']}",
-                'created_at_raw': created_raw,
-                'last_seen_raw': last_raw,
-                'created_at': format_dt_for_tashkent(created_raw),
-                'last_seen': format_dt_for_tashkent(last_raw)
-            })
-        return result
+            LIMIT $2
+        ''', last_id, page_size)
+        if not rows:
+            return
+        page = [r['user_id'] for r in rows]
+        last_id = page[-1]
+        yield page
 
 
 async def get_user_by_username(username: str) -> Optional[int]:
     """
     Return user_id for given username or None.
     """
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        return await conn.fetchval('SELECT user_id FROM users WHERE username = $1', username)
+    db = await get_pool()
+    return await db.fetchval('SELECT user_id FROM users WHERE username = $1', username)
 
 
 async def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
     """
     Return user row by user_id with both raw datetimes and formatted strings, or None.
     """
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow('''
-            SELECT user_id, username, created_at, last_seen, is_active
-            FROM users
-            WHERE user_id = $1
-        ''', user_id)
-        if not row:
-            return None
-        created_raw = row.get('created_at')
-        last_raw = row.get('last_seen')
-        return {
-            'user_id': row['user_id'],
-            'username': row.get('username'),
-            'display_name': f"@{row.get('username')}" if row.get('username') else f"ID:{row['user_id']}",
-            'created_at_raw': created_raw,
-            'last_seen_raw': last_raw,
-            'created_at': format_dt_for_tashkent(created_raw),
-            'last_seen': format_dt_for_tashkent(last_raw),
-            'is_active': bool(row.get('is_active'))
-        }
+    db = await get_pool()
+    row = await db.fetchrow('''
+        SELECT user_id, username, created_at, last_seen, is_active
+        FROM users
+        WHERE user_id = $1
+    ''', user_id)
+    if not row:
+        return None
+    created_raw = row.get('created_at')
+    last_raw = row.get('last_seen')
+    return {
+        'user_id': row['user_id'],
+        'username': row.get('username'),
+        'display_name': f"@{row.get('username')}" if row.get('username') else f"ID:{row['user_id']}",
+        'created_at_raw': created_raw,
+        'last_seen_raw': last_raw,
+        'created_at': format_dt_for_tashkent(created_raw),
+        'last_seen': format_dt_for_tashkent(last_raw),
+        'is_active': bool(row.get('is_active'))
+    }
 
 
 async def get_user_by_identifier(identifier: str) -> Optional[int]:
@@ -220,65 +395,103 @@ async def get_user_by_identifier(identifier: str) -> Optional[int]:
     If numeric -> return that user_id if exists.
     If not numeric -> treat as username and look up user_id.
     """
-    global pool
-    if pool is None:
-        await create_db_pool()
+    db = await get_pool()
     identifier = identifier.strip()
     if identifier.isdigit():
         uid = int(identifier)
-        async with pool.acquire() as conn:
-            exists = await conn.fetchval('SELECT 1 FROM users WHERE user_id = $1', uid)
-            return uid if exists else None
+        exists = await db.fetchval('SELECT 1 FROM users WHERE user_id = $1', uid)
+        return uid if exists else None
     if identifier.startswith("@"):
         identifier = identifier[1:]
-    async with pool.acquire() as conn:
-        return await conn.fetchval('SELECT user_id FROM users WHERE username = $1', identifier)
+    return await db.fetchval('SELECT user_id FROM users WHERE username = $1', identifier)
 
 
 async def deactivate_user(user_id: int) -> None:
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        await conn.execute('UPDATE users SET is_active = FALSE WHERE user_id = $1', user_id)
+    db = await get_pool()
+    await db.execute('UPDATE users SET is_active = FALSE WHERE user_id = $1', user_id)
+
+
+async def deactivate_users(user_ids: List[int]) -> None:
+    """Deactivate many users with one array-parameter UPDATE."""
+    if not user_ids:
+        return
+    db = await get_pool()
+    await db.execute('UPDATE users SET is_active = FALSE WHERE user_id = ANY($1::bigint[])', user_ids)
 
 
 async def get_users_count() -> int:
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        return await conn.fetchval('SELECT COUNT(*) FROM users WHERE is_active = TRUE')
+    db = await get_pool()
+    return await db.fetchval('SELECT COUNT(*) FROM users WHERE is_active = TRUE')
 
 
 async def is_admin(user_id: int) -> bool:
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        val = await conn.fetchval('SELECT 1 FROM admins WHERE user_id = $1', user_id)
-        return bool(val)
+    db = await get_pool()
+    val = await db.fetchval('SELECT 1 FROM admins WHERE user_id = $1', user_id)
+    return bool(val)
+
+
+async def _refresh_admin_ids() -> None:
+    """Reload both admin sets in one round-trip; concurrent callers wait for a single refresh."""
+    global _admin_ids, _superadmin_ids, _admin_ids_expires
+    async with _admin_ids_lock:
+        if time.monotonic() < _admin_ids_expires:
+            return
+        try:
+            db = await get_pool()
+            rows = await db.fetch('''
+                SELECT user_id, FALSE AS is_superadmin FROM admins
+                UNION ALL
+                SELECT user_id, TRUE FROM superadmins
+            ''')
+        except Exception as e:
+            # waiters queued on the lock see the new expiry and skip their own reload
+            logger.error(f"Admin snapshot refresh failed, retrying in {ADMIN_CACHE_RETRY}s: {e}")
+            _admin_ids_expires = time.monotonic() + ADMIN_CACHE_RETRY
+            return
+        _admin_ids = {r['user_id'] for r in rows if not r['is_superadmin']}
+        _superadmin_ids = {r['user_id'] for r in rows if r['is_superadmin']}
+        _admin_ids_expires = time.monotonic() + ADMIN_CACHE_TTL
+
+
+async def is_admin_cached(user_id: int) -> bool:
+    """
+    is_admin() answered from the in-process admin set snapshot, for per-message filters.
+    The snapshot is refreshed every ADMIN_CACHE_TTL seconds and after add/remove admin.
+    """
+    if time.monotonic() >= _admin_ids_expires:
+        await _refresh_admin_ids()
+    return user_id in _admin_ids
+
+
+def peek_admin_cache(user_id: int) -> Optional[bool]:
+    """Return the admin flag if the snapshot is still fresh, else None. Never touches the DB."""
+    if time.monotonic() >= _admin_ids_expires:
+        return None
+    return user_id in _admin_ids
+
+
+def invalidate_admin_cache() -> None:
+    """Mark the admin snapshot stale; the next lookup reloads it."""
+    global _admin_ids_expires
+    _admin_ids_expires = 0.0
 
 
 async def get_admins() -> List[Dict[str, Any]]:
     """
     Return admins with created_at formatted (suitable for displaying in lists).
     """
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch('SELECT user_id, username, created_at FROM admins ORDER BY user_id')
-        result = []
-        for r in rows:
-            created_raw = r.get('created_at')
-            result.append({
-                'user_id': r['user_id'],
-                'username': r.get('username'),
-                'display_name': f"@{r.get('username')}" if r.get('username') else f"ID:{r['user_id']}",
-                'created_at': format_dt_for_tashkent(created_raw)
-            })
-        return result
+    db = await get_pool()
+    rows = await db.fetch('SELECT user_id, username, created_at FROM admins ORDER BY user_id')
+    result = []
+    for r in rows:
+        created_raw = r.get('created_at')
+        result.append({
+            'user_id': r['user_id'],
+            'username': r.get('username'),
+            'display_name': f"@{r.get('username')}" if r.get('username') else f"ID:{r['user_id']}",
+            'created_at': format_dt_for_tashkent(created_raw)
+        })
+    return result
 
 
 async def get_admin_meta(user_id: int) -> Optional[Dict[str, Any]]:
@@ -286,83 +499,70 @@ async def get_admin_meta(user_id: int) -> Optional[Dict[str, Any]]:
     Return admin meta. For program logic 'created_at' is raw datetime (useful for comparisons).
     Also return 'created_at_str' formatted for display.
     """
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow('SELECT user_id, username, created_at FROM admins WHERE user_id = $1', user_id)
-        if not row:
-            return None
-        created_raw = row.get('created_at')
-        return {
-            'user_id': row['user_id'],
-            'username': row.get('username'),
-            'created_at': created_raw,
-            'created_at_str': format_dt_for_tashkent(created_raw),
-            'display_name': f"@{row.get('username')}" if row.get('username') else f"ID:{row['user_id']}"
-        }
+    db = await get_pool()
+    row = await db.fetchrow('SELECT user_id, username, created_at FROM admins WHERE user_id = $1', user_id)
+    if not row:
+        return None
+    created_raw = row.get('created_at')
+    return {
+        'user_id': row['user_id'],
+        'username': row.get('username'),
+        'created_at': created_raw,
+        'created_at_str': format_dt_for_tashkent(created_raw),
+        'display_name': f"@{row.get('username')}" if row.get('username') else f"ID:{row['user_id']}"
+    }
 
 
 async def add_admin(user_id: int, username: Optional[str] = None) -> None:
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO admins (user_id, username, created_at)
-            VALUES ($1, $2, NOW())
-            ON CONFLICT (user_id)
-            DO UPDATE SET username = COALESCE(EXCLUDED.username, admins.username)
-        ''', user_id, username)
+    db = await get_pool()
+    await db.execute('''
+        INSERT INTO admins (user_id, username, created_at)
+        VALUES ($1, $2, NOW())
+        ON CONFLICT (user_id)
+        DO UPDATE SET username = COALESCE(EXCLUDED.username, admins.username)
+    ''', user_id, username)
+    invalidate_admin_cache()
 
 
 async def remove_admin(user_id: int) -> None:
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        await conn.execute('DELETE FROM admins WHERE user_id = $1', user_id)
+    db = await get_pool()
+    await db.execute('DELETE FROM admins WHERE user_id = $1', user_id)
+    invalidate_admin_cache()
 
 
 async def log_admin_action(admin_id: int, action: str, target_user_id: Optional[int] = None, details: Optional[str] = None) -> None:
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO admin_audit (admin_id, action, target_user_id, details)
-            VALUES ($1, $2, $3, $4)
-        ''', admin_id, action, target_user_id, details)
+    db = await get_pool()
+    await db.execute('''
+        INSERT INTO admin_audit (admin_id, action, target_user_id, details)
+        VALUES ($1, $2, $3, $4)
+    ''', admin_id, action, target_user_id, details)
 
 
 async def is_superadmin(user_id: int) -> bool:
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        val = await conn.fetchval('SELECT 1 FROM superadmins WHERE user_id = $1', user_id)
-        return bool(val)
+    db = await get_pool()
+    val = await db.fetchval('SELECT 1 FROM superadmins WHERE user_id = $1', user_id)
+    return bool(val)
+
+
+async def get_admin_flags_cached(user_id: int) -> Tuple[bool, bool]:
+    """(is_admin, is_superadmin) answered from the admin set snapshot."""
+    if time.monotonic() >= _admin_ids_expires:
+        await _refresh_admin_ids()
+    return user_id in _admin_ids, user_id in _superadmin_ids
 
 
 async def get_superadmin_id() -> Optional[int]:
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        return await conn.fetchval('SELECT user_id FROM superadmins LIMIT 1')
+    db = await get_pool()
+    return await db.fetchval('SELECT user_id FROM superadmins LIMIT 1')
 
 
 async def add_superadmin(user_id: int) -> None:
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        await conn.execute('INSERT INTO superadmins (user_id) VALUES ($1) ON CONFLICT DO NOTHING', user_id)
+    db = await get_pool()
+    await db.execute('INSERT INTO superadmins (user_id) VALUES ($1) ON CONFLICT DO NOTHING', user_id)
+    invalidate_admin_cache()
 
 
 async def remove_superadmin(user_id: int) -> None:
-    global pool
-    if pool is None:
-        await create_db_pool()
-    async with pool.acquire() as conn:
-        await conn.execute('DELETE FROM superadmins WHERE user_id = $1', user_id)
+    db = await get_pool()
+    await db.execute('DELETE FROM superadmins WHERE user_id = $1', user_id)
+    invalidate_admin_cache()
@@ -1,6 +1,7 @@
 import time
 import random
 import asyncio
+import logging
 from aiogram.types import CallbackQuery, BufferedInputFile
 from config import MAX_MANUAL_RETRIES, MAX_AUTO_RETRIES, AUTO_BACKOFFS, USER_COOLDOWN
 from loader import logger, bot
@@ -72,7 +73,10 @@ async def handle_retry_callback(query: CallbackQuery):
             success = True
             break
         except Exception as e:
-            logger.exception(f"Retry failed: {e}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.exception(f"Retry failed: {e}")
+            else:
+                logger.warning("Retry failed: %s", e)
 
     release_ongoing(chat_id)
     if success:
@@ -109,8 +113,7 @@ async def handle_expand_callback(query: CallbackQuery):
     try:
         stream_gen = get_gpt_reply(chat_id, detailed_prompt)
 
-        new_msg = await query.message.answer("...")
-        reply = await process_stream_draft(new_msg, stream_gen)
+        reply = await process_stream_draft(query.message, stream_gen)
 
         try: await safe_update_history(chat_id, reply, role="assistant")
         except: pass
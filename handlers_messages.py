@@ -1,20 +1,22 @@
 import asyncio
+import contextlib
 import time
 import os
 import re 
-import base64 
+from io import BytesIO
 import logging
 from aiogram import Router, F, Bot
 from aiogram.types import Message, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.enums import ChatAction
 from aiogram.exceptions import TelegramRetryAfter
-from aiogram.filters import Command
 from datetime import datetime, timezone
+from typing import List
 
 from config import CONCISE_INSTRUCTION, STRICT_MATH_RULES, CONTEXT_WINDOW
 from loader import logger, bot
-from database import save_user, log_user_activity, is_admin, is_superadmin
+from database import log_user_activity, get_admin_flags_cached
 from keyboards import admin_keyboard
 from helpers import process_daily_pin
 from services import (
@@ -28,68 +30,114 @@ chat_last_interaction = {}
 
 SESSION_TIMEOUT = 86400 
 
+TYPING_INTERVAL = 4
+
+EDIT_MIN_INTERVAL    = 1.5
+EDIT_MIN_CHARS       = 400
+EDIT_MIN_NEW_CHARS   = 30
+RETRY_AFTER_MAX_WAIT = 30
+
+MAX_TEXT_LENGTH   = 5000
+USER_MIN_INTERVAL = 1.0
+USER_RATE_PRUNE_SIZE = 10000
+_user_last_request = {}
+
+PHOTO_CONCURRENCY = 8
+_photo_slots      = asyncio.Semaphore(PHOTO_CONCURRENCY)
+
+RULES_PREFIX    = CONCISE_INSTRUCTION + STRICT_MATH_RULES
+QUESTION_PREFIX = RULES_PREFIX + "\n\nSavol: "
+
+WELCOME_TEXT = (
+    "👋 <b>Keling tanishib olaylik!</b>\n\n"
+    "🤖 Men sizning AI yordamchimman. Quyidagilarni qila olaman:\n"
+    "➤ Savollaringizga javob beraman (Internetdan ham qidiraman 🌐)\n"
+    "➤ 📺 <b>YouTube</b> video silkasini tashlasangiz, uni qisqacha xulosa qilib beraman!\n"
+    "➤ 📄 <b>Hujjatlar (PDF/TXT)</b> yuborsangiz, o'qib tahlil qilaman!\n"
+    "➤ 📸 <b>Rasm</b> yuborsangiz — uni xuddi insondek ko'rib tushuntiraman!\n"
+    "➤ 🎙 <b>Ovozli xabar</b> yuborsangiz — <b>ovozli javob</b> qaytaraman!\n\n"
+    "🧹 Agar suhbatni noldan boshlamoqchi bo'lsangiz /new buyrug'ini bering.\n\n"
+    "✍️ Savolingizni yozing, rasm, hujjat yoki ovoz yuboring. Boshladikmi?"
+)
+ADMIN_WELCOME_TEXT = "👋 <b>Admin panelga xush kelibsiz!</b>"
+BUSY_TEXT          = "Iltimos kuting, javob generatsiya qilinmoqda..."
+TOO_LONG_TEXT      = "📏 Matn juda uzun."
+EMPTY_TEXT         = "✍️ Savolingizni matn ko'rinishida yozing."
+
+DOC_EXTENSIONS = (".pdf", ".txt")
+DOC_MAX_SIZE   = 5 * 1024 * 1024
+DOC_TYPE_TEXT  = "⚠️ Faqat **PDF** va **TXT** fayllarni o'qiy olaman."
+DOC_SIZE_TEXT  = "⚠️ Fayl hajmi juda katta. Iltimos, **5 MB** gacha yuboring."
+
+_background_tasks = set()
+
+def _bg(coro) -> None:
+    """Fon vazifasi: havola saqlanadi (GC yo'qotmaydi), xatosi logga yoziladi."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_bg_done)
+
+def _bg_done(task: asyncio.Task) -> None:
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Fon vazifasi xatosi: {task.exception()}")
+
 class GeneratingState(StatesGroup):
     generating = State()
 
 @router.message(GeneratingState.generating)
 async def busy_handler(message: Message):
-    await message.answer("Iltimos kuting, javob generatsiya qilinmoqda...")
+    await message.answer(BUSY_TEXT)
+
+def _draft_text(full_text: str) -> str:
+    """Oraliq qoralama matni: [NO_BUTTON] olib tashlanadi, ochiq ``` yopiladi."""
+    text = full_text.replace("[NO_BUTTON]", "").strip()
+    if text.count("```") % 2 != 0:
+        text += "\n```"
+    return text
 
 async def process_stream_draft(message: Message, stream_generator) -> str:
-    """AI javob berguncha Custom Emoji aylanib turadi, kelgach Markdown bilan silliq yozib ketadi."""
-    full_text = ""
-    chunk_buffer = "" 
-
-    emojis = [
-        '5818740758257077530',
-        '5980787993139481991',
-        '5821116867309210830',
-    ]
+    """AI javob berguncha "typing" holati ko'rsatiladi, kelgach Markdown bilan silliq yozib ketadi."""
+    parts: List[str] = []
+    pending = 0
     
+    send_draft = message.bot.send_message_draft
+    chat_id    = message.chat.id
+    draft_id   = message.message_id
+    thread_id  = message.message_thread_id
+
+    now_fn         = asyncio.get_running_loop().time
+    last_edit      = 0.0
+    suppress_until = 0.0
+
     stop_animation = asyncio.Event()
-    shared_state = {"emoji_id": emojis[0], "status": "<b>ㅤ</b>"}
 
-    async def emoji_animator():
-        idx = 0
+    async def typing_indicator():
+        send_action = message.bot.send_chat_action
         while not stop_animation.is_set():
-            shared_state["emoji_id"] = emojis[idx % len(emojis)]
-            
-            text_to_send = f'<tg-emoji emoji-id="{shared_state["emoji_id"]}">🔄</tg-emoji>{shared_state["status"]}\u200c'
-            
-            wait_time = 1.5  
+            wait_time = TYPING_INTERVAL
             try:
-                await message.bot.send_message_draft(
-                    chat_id=message.chat.id,
-                    draft_id=message.message_id,
-                    text=text_to_send,
-                    parse_mode="HTML",
-                    message_thread_id=message.message_thread_id
-                )
+                await send_action(chat_id, ChatAction.TYPING, message_thread_id=thread_id)
             except TelegramRetryAfter as e:
                 wait_time = e.retry_after + 0.1
             except Exception:
                 pass
-            
-            idx += 1
-            
-            try:
+
+            with contextlib.suppress(asyncio.TimeoutError):
                 await asyncio.wait_for(stop_animation.wait(), timeout=wait_time)
-            except asyncio.TimeoutError:
-                pass
 
-    anim_task = asyncio.create_task(emoji_animator())
+    anim_task = asyncio.create_task(typing_indicator())
 
     try:
         async for chunk in stream_generator:
             if not chunk: continue
             
             if chunk.startswith("[STATUS]"):
-                shared_state["status"] = chunk.replace("[STATUS]", "").strip()
                 continue
 
             if "[CLEAR_TEXT]" in chunk:
-                full_text = "" 
-                chunk_buffer = ""
+                parts.clear()
+                pending = 0
                 chunk = chunk.replace("[CLEAR_TEXT]", "")
                 if not chunk: continue
             
@@ -97,56 +145,56 @@ async def process_stream_draft(message: Message, stream_generator) -> str:
                 if not stop_animation.is_set():
                     stop_animation.set()
 
-            full_text += chunk
-            chunk_buffer += chunk
+            parts.append(chunk)
+            pending += len(chunk)
             
-            clean_text = full_text.replace("[NO_BUTTON]", "").strip()
-            
-            if len(chunk_buffer) >= 30:
-                display_text = clean_text
-                if display_text.count("```") % 2 != 0:
-                    display_text += "\n```" 
-
-                try:
-                    await message.bot.send_message_draft(
-                        chat_id=message.chat.id,
-                        draft_id=message.message_id,
-                        text=display_text,
-                        parse_mode="Markdown", 
-                        message_thread_id=message.message_thread_id
-                    )
-                    chunk_buffer = "" 
-                    await asyncio.sleep(0.3) 
-                except TelegramRetryAfter as e:
-                    await asyncio.sleep(e.retry_after)
-                except Exception:
-                    pass
+            now = now_fn()
+            if now < suppress_until:
+                continue
+            if pending < EDIT_MIN_NEW_CHARS:
+                continue
+            if now - last_edit < EDIT_MIN_INTERVAL and pending < EDIT_MIN_CHARS:
+                continue
+
+            last_edit = now
+            try:
+                await send_draft(
+                    chat_id=chat_id,
+                    draft_id=draft_id,
+                    text=_draft_text("".join(parts)),
+                    parse_mode="Markdown", 
+                    message_thread_id=thread_id
+                )
+                pending = 0
+            except TelegramRetryAfter as e:
+                # Jarima tugaguncha yangilanishlar yuborilmaydi, oqim esa o'qilishda davom etadi
+                suppress_until = now + min(e.retry_after, RETRY_AFTER_MAX_WAIT)
+            except Exception:
+                pass
     finally:
         stop_animation.set()
-        try:
+        with contextlib.suppress(Exception):
             await anim_task
-        except Exception:
-            pass
 
+    full_text  = "".join(parts)
     clean_text = full_text.replace("[NO_BUTTON]", "").strip()
     
-    if chunk_buffer:
-        display_text = clean_text
-        if display_text.count("```") % 2 != 0:
-            display_text += "\n```"
-        try:
-            await message.bot.send_message_draft(
-                chat_id=message.chat.id,
-                draft_id=message.message_id,
-                text=display_text,
+    if pending and now_fn() >= suppress_until:
+        with contextlib.suppress(Exception):
+            await send_draft(
+                chat_id=chat_id,
+                draft_id=draft_id,
+                text=_draft_text(full_text),
                 parse_mode="Markdown",
-                message_thread_id=message.message_thread_id
+                message_thread_id=thread_id
             )
-        except Exception:
-            pass
 
     if clean_text:
-        await message.answer(clean_text, parse_mode="Markdown")
+        try:
+            await message.answer(clean_text, parse_mode="Markdown")
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            await message.answer(clean_text, parse_mode="Markdown")
 
     return clean_text
 
@@ -156,72 +204,80 @@ async def check_and_clear_session(chat_id: int):
     
     if now - last_time > SESSION_TIMEOUT:
         await clear_chat_history(chat_id)
-        try:
-            msg = await bot.send_message(
-                chat_id,
-                "🧹 <i>Suhbat xotirasi yangilandi.</i>",
-                parse_mode="HTML"
-            )
-            asyncio.create_task(delete_msg_later(chat_id, msg.message_id, 5))
-        except:
-            pass
+        # Eslatma javobni kutdirmaydi — fonda yuboriladi va 5 s dan keyin o'chiriladi
+        _bg(_session_notice(chat_id))
         
     chat_last_interaction[chat_id] = now
 
+async def _session_notice(chat_id: int):
+    with contextlib.suppress(Exception):
+        msg = await bot.send_message(
+            chat_id,
+            "🧹 <i>Suhbat xotirasi yangilandi.</i>",
+            parse_mode="HTML"
+        )
+        await delete_msg_later(chat_id, msg.message_id, 5)
+
 async def delete_msg_later(chat_id: int, message_id: int, delay: int):
     await asyncio.sleep(delay)
-    try:
+    with contextlib.suppress(Exception):
         await bot.delete_message(chat_id, message_id)
-    except:
-        pass
 
 
-@router.message(Command("start"))
 async def handle_start(message: Message, state: FSMContext):
     await state.clear() 
-    try:
-        asyncio.create_task(save_user(message.from_user.id, message.from_user.username))
-        asyncio.create_task(log_user_activity(message.from_user.id, message.from_user.username, "start"))
-    except Exception:
-        pass
+    user     = message.from_user
+    user_id  = user.id
+    username = user.username
+    log_user_activity(user_id, username, "start")
 
     try:
-        admin_flag = await is_admin(message.from_user.id)
-        super_flag = await is_superadmin(message.from_user.id)
+        admin_flag, super_flag = await get_admin_flags_cached(user_id)
         if admin_flag or super_flag:
-            await message.answer("👋 <b>Admin panelga xush kelibsiz!</b>", reply_markup=admin_keyboard)
+            await message.answer(ADMIN_WELCOME_TEXT, reply_markup=admin_keyboard)
             return
     except:
         pass
 
-    await message.answer(
-        "👋 <b>Keling tanishib olaylik!</b>\n\n"
-        "🤖 Men sizning AI yordamchimman. Quyidagilarni qila olaman:\n"
-        "➤ Savollaringizga javob beraman (Internetdan ham qidiraman 🌐)\n"
-        "➤ 📺 <b>YouTube</b> video silkasini tashlasangiz, uni qisqacha xulosa qilib beraman!\n"
-        "➤ 📄 <b>Hujjatlar (PDF/TXT)</b> yuborsangiz, o'qib tahlil qilaman!\n"
-        "➤ 📸 <b>Rasm</b> yuborsangiz — uni xuddi insondek ko'rib tushuntiraman!\n"
-        "➤ 🎙 <b>Ovozli xabar</b> yuborsangiz — <b>ovozli javob</b> qaytaraman!\n\n"
-        "🧹 Agar suhbatni noldan boshlamoqchi bo'lsangiz /new buyrug'ini bering.\n\n"
-        "✍️ Savolingizni yozing, rasm, hujjat yoki ovoz yuboring. Boshladikmi?"
-    )
+    await message.answer(WELCOME_TEXT)
+
+
+def _rate_limited(user_id: int) -> bool:
+    """Foydalanuvchi USER_MIN_INTERVAL ichida qayta yozgan bo'lsa True (API ga so'rov yuborilmaydi)."""
+    now  = time.monotonic()
+    last = _user_last_request.get(user_id)
+    if last is not None and now - last < USER_MIN_INTERVAL:
+        return True
+    if len(_user_last_request) >= USER_RATE_PRUNE_SIZE:
+        for uid in [uid for uid, ts in _user_last_request.items() if now - ts >= USER_MIN_INTERVAL]:
+            del _user_last_request[uid]
+    _user_last_request[user_id] = now
+    return False
 
 
-@router.message(F.text)
 async def handle_text(message: Message, state: FSMContext):
-    if len(message.text) > 5000:
-        await message.answer("📏 Matn juda uzun.")
+    # Arzon tekshiruvlar har qanday I/O dan oldin
+    if not message.text or message.text.isspace():
+        await message.answer(EMPTY_TEXT)
+        return
+    if len(message.text) > MAX_TEXT_LENGTH:
+        await message.answer(TOO_LONG_TEXT)
         return
 
-    user_id  = message.from_user.id
+    user     = message.from_user
+    user_id  = user.id
+    username = user.username
     chat_id  = message.chat.id
     text_str = message.text.strip()
+    # Suhbatni tozalash buyrug'i rate limitga tushmaydi — tez yuborilgan /new ham bajariladi
+    is_reset = text_str.lower() in ["/new", "/clear", "yangi suhbat"]
+    if not is_reset and _rate_limited(user_id):
+        return
     
-    await save_user(user_id, message.from_user.username)
-    await log_user_activity(user_id, message.from_user.username, "text_message")
-    asyncio.create_task(process_daily_pin(chat_id, message.message_id))
+    log_user_activity(user_id, username, "text_message")
+    _bg(process_daily_pin(chat_id, message.message_id))
 
-    if text_str.lower() in ["/new", "/clear", "yangi suhbat"]:
+    if is_reset:
         await clear_chat_history(chat_id)
         chat_last_interaction[chat_id] = time.time()
         await message.answer("🧹 Xotira tozalandi! Mutlaqo yangi mavzuda suhbatlashishimiz mumkin.")
@@ -244,14 +300,14 @@ async def handle_text(message: Message, state: FSMContext):
             await process_stream_draft(message, stream_gen)
             return
 
-        try:
-            await safe_update_history(chat_id, message.text, role="user")
-        except:
-            pass
+        # Tarixsiz (yangi) suhbatda javob faqat savolga bog'liq — keshdan olish mumkin
+        fresh_chat   = not await safe_get_chat_history(chat_id, limit=1)
+        history_task = asyncio.create_task(safe_update_history(chat_id, message.text, role="user"))
 
-        prompt     = CONCISE_INSTRUCTION + STRICT_MATH_RULES + "\n\nSavol: " + message.text
-        stream_gen = get_gpt_reply(chat_id, prompt)
+        prompt     = QUESTION_PREFIX + message.text
+        stream_gen = get_gpt_reply(chat_id, prompt, cacheable=fresh_chat)
         full_reply = await process_stream_draft(message, stream_gen)
+        await history_task
 
         try:
             await safe_update_history(chat_id, full_reply, role="assistant")
@@ -265,36 +321,36 @@ async def handle_text(message: Message, state: FSMContext):
         await state.clear()
 
 
-@router.message(F.photo)
 async def handle_photo(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    chat_id = message.chat.id
+    user     = message.from_user
+    user_id  = user.id
+    username = user.username
+    chat_id  = message.chat.id
     
-    await save_user(user_id, message.from_user.username)
-    await log_user_activity(user_id, message.from_user.username, "photo_message")
-    asyncio.create_task(process_daily_pin(chat_id, message.message_id))
+    log_user_activity(user_id, username, "photo_message")
+    _bg(process_daily_pin(chat_id, message.message_id))
 
     await check_and_clear_session(chat_id)
     await state.set_state(GeneratingState.generating)
 
     try:
-        photo = message.photo[-1]
-        file  = await bot.get_file(photo.file_id)
-        from io import BytesIO
-        result = BytesIO()
-        await bot.download_file(file.file_path, result)
-        image_bytes  = result.getvalue()
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
-        caption      = message.caption if message.caption else "Bu rasmda nimalar borligini to'liq tushuntirib ber."
-        
-        try:
-            await safe_update_history(chat_id, f"[Rasm yuborildi]: {caption}", role="user")
-        except:
-            pass
-        
-        prompt     = CONCISE_INSTRUCTION + STRICT_MATH_RULES + "\n\nSavol: " + caption
-        stream_gen = get_vision_reply(chat_id, base64_image, prompt)
-        full_reply = await process_stream_draft(message, stream_gen)
+        # Bir vaqtda tahlil qilinadigan rasmlar soni cheklanadi (xotira va API limiti)
+        async with _photo_slots:
+            photo = message.photo[-1]
+            file  = await bot.get_file(photo.file_id)
+            image = BytesIO()
+            await bot.download_file(file.file_path, image)
+            caption      = message.caption if message.caption else "Bu rasmda nimalar borligini to'liq tushuntirib ber."
+            
+            history_task = asyncio.create_task(
+                safe_update_history(chat_id, f"[Rasm yuborildi]: {caption}", role="user")
+            )
+            
+            prompt     = QUESTION_PREFIX + caption
+            stream_gen = get_vision_reply(chat_id, image, prompt)
+            image = None
+            full_reply = await process_stream_draft(message, stream_gen)
+            await history_task
 
         try:
             await safe_update_history(chat_id, full_reply, role="assistant")
@@ -308,49 +364,45 @@ async def handle_photo(message: Message, state: FSMContext):
         await state.clear()
 
 
-@router.message(F.document)
 async def handle_document(message: Message, state: FSMContext):
-    user_id   = message.from_user.id
+    user      = message.from_user
+    user_id   = user.id
+    username  = user.username
     chat_id   = message.chat.id
     document  = message.document
     file_name = document.file_name.lower()
     
-    await save_user(user_id, message.from_user.username)
-    await log_user_activity(user_id, message.from_user.username, "document_message")
-    asyncio.create_task(process_daily_pin(chat_id, message.message_id))
+    log_user_activity(user_id, username, "document_message")
+    _bg(process_daily_pin(chat_id, message.message_id))
 
     await check_and_clear_session(chat_id)
 
-    if not (file_name.endswith('.pdf') or file_name.endswith('.txt')):
-        await message.answer(
-            "⚠️ Faqat **PDF** va **TXT** fayllarni o'qiy olaman.",
-            parse_mode="Markdown"
-        )
+    if not file_name.endswith(DOC_EXTENSIONS):
+        await message.answer(DOC_TYPE_TEXT, parse_mode="Markdown")
         return
 
-    if document.file_size > 5 * 1024 * 1024:
-        await message.answer(
-            "⚠️ Fayl hajmi juda katta. Iltimos, **5 MB** gacha yuboring.",
-            parse_mode="Markdown"
-        )
+    if document.file_size > DOC_MAX_SIZE:
+        await message.answer(DOC_SIZE_TEXT, parse_mode="Markdown")
         return
 
     await state.set_state(GeneratingState.generating)
 
     try:
         file = await bot.get_file(document.file_id)
-        from io import BytesIO
         result = BytesIO()
         await bot.download_file(file.file_path, result)
         file_bytes = result.getvalue()
         
-        extracted_text = extract_text_from_document(file_bytes, file_name)
+        extracted_text = await asyncio.to_thread(extract_text_from_document, file_bytes, file_name)
+        result = file_bytes = None
         caption        = message.caption if message.caption else "Shu hujjatning qisqacha mazmunini yozib ber."
         
-        try:
-            await safe_update_history(chat_id, f"[Hujjat yuborildi]: {caption}", role="user")
-        except:
-            pass
+        # Kesh oldindan to'ldiriladi: fondagi yozuv va javobdagi tarix o'qishi bir-birini kutmaydi,
+        # aks holda yangi xabar modelga ikki marta tushishi mumkin
+        await safe_get_chat_history(chat_id, limit=1)
+        history_task = asyncio.create_task(
+            safe_update_history(chat_id, f"[Hujjat yuborildi]: {caption}", role="user")
+        )
         
         prompt = (
             f"{CONCISE_INSTRUCTION}\n\n"
@@ -359,6 +411,7 @@ async def handle_document(message: Message, state: FSMContext):
         )
         stream_gen = get_gpt_reply(chat_id, prompt)
         full_reply = await process_stream_draft(message, stream_gen)
+        await history_task
 
         try:
             await safe_update_history(chat_id, full_reply, role="assistant")
@@ -372,14 +425,14 @@ async def handle_document(message: Message, state: FSMContext):
         await state.clear()
 
 
-@router.message(F.voice)
 async def handle_voice(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    chat_id = message.chat.id
+    user     = message.from_user
+    user_id  = user.id
+    username = user.username
+    chat_id  = message.chat.id
     
-    await save_user(user_id, message.from_user.username)
-    await log_user_activity(user_id, message.from_user.username, "voice_message")
-    asyncio.create_task(process_daily_pin(chat_id, message.message_id))
+    log_user_activity(user_id, username, "voice_message")
+    _bg(process_daily_pin(chat_id, message.message_id))
 
     await check_and_clear_session(chat_id)
     await state.set_state(GeneratingState.generating)
@@ -399,14 +452,13 @@ async def handle_voice(message: Message, state: FSMContext):
 
         await message.reply(f"🗣 <b>Siz:</b> \"{user_text}\"", parse_mode="HTML")
         
-        try:
-            await safe_update_history(chat_id, user_text, role="user")
-        except:
-            pass
+        await safe_get_chat_history(chat_id, limit=1)  # kesh oldindan to'ldiriladi (handle_document ga qarang)
+        history_task = asyncio.create_task(safe_update_history(chat_id, user_text, role="user"))
         
-        prompt          = CONCISE_INSTRUCTION + STRICT_MATH_RULES + "\n\n" + user_text
+        prompt          = RULES_PREFIX + "\n\n" + user_text
         stream_gen      = get_gpt_reply(chat_id, prompt)
         full_reply_text = await process_stream_draft(message, stream_gen)
+        await history_task
 
         try:
             await safe_update_history(chat_id, full_reply_text, role="assistant")
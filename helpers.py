@@ -1,12 +1,31 @@
 import asyncio
-import random
+import itertools
 from datetime import datetime, timezone, timedelta
+from typing import List, Set, Tuple
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.exceptions import TelegramForbiddenError, TelegramNotFound, TelegramRetryAfter
 
 from config import ERROR_MESSAGES
 from loader import logger, bot
 import database
 from memory import store_failed_request
+from ratelimit import bulk_send_bucket
+
+UZ_TZ = timezone(timedelta(hours=5))
+_error_rotation = itertools.cycle(ERROR_MESSAGES)
+
+NOTIFY_WORKERS = 25
+NOTIFY_UPDATE_CHUNK = 1000
+NOTIFY_PAGE_SIZE = 5000
+NOTIFY_MAX_RETRIES = 3
+NOTIFY_RUN_HOUR = 3
+
+# /notify_inactive_now buyrug'i shu eventni o'rnatib, jobni darhol uyg'otadi
+notify_trigger = asyncio.Event()
+
+# Bugungi kunda pin qilingan chatlar — kun almashganda tozalanadi
+_pinned_today: Set[int] = set()
+_pinned_day = None
 
 def make_retry_keyboard(chat_id: int, attempts: int = 0):
     kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -22,7 +41,7 @@ async def send_error_with_retry(chat_id: int, message_id: int, user_id: int, pro
     """
     text = (reason + "\n\n") if reason else ""
     if ERROR_MESSAGES:
-        text += random.choice(ERROR_MESSAGES)
+        text += next(_error_rotation)
     else:
         text += "❌ Xatolik yuz berdi. Qayta urinib ko'ring."
         
@@ -44,45 +63,124 @@ async def send_error_with_retry(chat_id: int, message_id: int, user_id: int, pro
     )
 
 async def ensure_pin_column():
-    async with database.pool.acquire() as conn:
-        try:
-            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_pinned_date DATE")
-            logger.info("Checked/Added last_pinned_date column in users table.")
-        except Exception as e:
-            logger.error(f"Column add error: {e}")
+    try:
+        db = await database.get_pool()
+        await db.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_pinned_date DATE")
+        logger.info("Checked/Added last_pinned_date column in users table.")
+    except Exception as e:
+        logger.error(f"Column add error: {e}")
 
 async def process_daily_pin(chat_id: int, message_id: int):
+    global _pinned_day
     try:
-        tz = timezone(timedelta(hours=5))
-        today = datetime.now(tz).date()
-        async with database.pool.acquire() as conn:
-            val = await conn.fetchval("SELECT last_pinned_date FROM users WHERE user_id = $1", chat_id)
-            if val != today:
-                try:
-                    await bot.pin_chat_message(chat_id=chat_id, message_id=message_id)
-                    await conn.execute("UPDATE users SET last_pinned_date = $1 WHERE user_id = $2", today, chat_id)
-                except Exception as ex:
-                    logger.debug(f"Pin message failed: {ex}")
+        today = datetime.now(UZ_TZ).date()
+        if _pinned_day != today:
+            _pinned_today.clear()
+            _pinned_day = today
+        # Bugun allaqachon pin qilingan chat uchun DB ga umuman murojaat qilinmaydi
+        if chat_id in _pinned_today:
+            return
+        db = await database.get_pool()
+        val = await db.fetchval("SELECT last_pinned_date FROM users WHERE user_id = $1", chat_id)
+        if val != today:
+            try:
+                await bot.pin_chat_message(chat_id=chat_id, message_id=message_id)
+                await db.execute("UPDATE users SET last_pinned_date = $1 WHERE user_id = $2", today, chat_id)
+            except Exception as ex:
+                logger.debug(f"Pin message failed: {ex}")
+                return
+        _pinned_today.add(chat_id)
     except Exception as e:
         logger.error(f"Daily pin error: {e}")
 
+async def _notify_one(user_id: int):
+    for _ in range(NOTIFY_MAX_RETRIES + 1):
+        await bulk_send_bucket.acquire()
+        try:
+            await bot.send_message(user_id, "👋 Salom! Sizni ko'rmaganimizga bir hafta bo'ldi. Yordam kerak bo'lsa, bemalol yozing!")
+            return user_id, True
+        except TelegramRetryAfter as e:
+            bulk_send_bucket.penalize(e.retry_after + 0.5)
+        except (TelegramForbiddenError, TelegramNotFound):
+            return user_id, False
+        except Exception as e:
+            logger.warning("Xatolik yuborishda %s: %s", user_id, e)
+            return user_id, None
+    return user_id, None
+
+async def _notify_page(user_ids: List[int]) -> Tuple[List[int], List[int]]:
+    """Sahifani NOTIFY_WORKERS ta ishchi bilan yuboradi (broadcast kabi); (xabar olganlar, bloklaganlar) qaytadi."""
+    queue: "asyncio.Queue[int]" = asyncio.Queue()
+    for uid in user_ids:
+        queue.put_nowait(uid)
+    notified: List[int] = []
+    blocked: List[int] = []
+
+    async def worker():
+        while True:
+            try:
+                uid = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            _, ok = await _notify_one(uid)
+            if ok:
+                notified.append(uid)
+            elif ok is False:
+                blocked.append(uid)
+
+    results = await asyncio.gather(
+        *(worker() for _ in range(min(NOTIFY_WORKERS, len(user_ids)))),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Notify worker failed: {result}")
+    return notified, blocked
+
+def _seconds_until_next_run() -> float:
+    now = datetime.now(UZ_TZ)
+    next_run = now.replace(hour=NOTIFY_RUN_HOUR, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
 async def notify_inactive_users():
     while True:
-        await asyncio.sleep(3600 * 24 * 7) 
-        async with database.pool.acquire() as conn:
-            try:
-                inactive_users = await conn.fetch('''
-                    SELECT user_id FROM users
-                    WHERE last_seen < NOW() - INTERVAL '7 days'
-                    AND is_active = TRUE
-                ''')
-                for record in inactive_users:
-                    user_id = record['user_id']
-                    try:
-                        await bot.send_message(user_id, "👋 Salom! Sizni ko'rmaganimizga bir hafta bo'ldi. Yordam kerak bo'lsa, bemalol yozing!")
-                        await conn.execute('UPDATE users SET last_seen = NOW() WHERE user_id = $1', user_id)
-                        await asyncio.sleep(0.1) 
-                    except Exception as e:
-                        logger.error(f"Xatolik yuborishda {user_id}: {e}")
-            except Exception as e:
-                logger.error(f"Notify job error: {e}")
+        # Har kuni 03:00 (UZ) da yoki admin buyrug'i bilan darhol ishga tushadi;
+        # so'rov faqat 7 kundan beri faol bo'lmaganlarni oladi, shuning uchun kunlik ishga tushirish xavfsiz
+        try:
+            await asyncio.wait_for(notify_trigger.wait(), timeout=_seconds_until_next_run())
+        except asyncio.TimeoutError:
+            pass
+        notify_trigger.clear()
+        try:
+            db = await database.get_pool()
+            last_id = 0
+            # Keyset sahifalash: xotirada faqat bitta sahifa, uzoq tranzaksiya yo'q
+            while True:
+                async with db.acquire() as conn:
+                    inactive_ids = [
+                        record['user_id'] for record in await conn.fetch('''
+                            SELECT user_id FROM users
+                            WHERE last_seen < NOW() - INTERVAL '7 days'
+                            AND is_active = TRUE
+                            AND user_id > $1
+                            ORDER BY user_id
+                            LIMIT $2
+                        ''', last_id, NOTIFY_PAGE_SIZE)
+                    ]
+                if not inactive_ids:
+                    break
+                last_id = inactive_ids[-1]
+
+                notified, blocked = await _notify_page(inactive_ids)
+
+                async with db.acquire() as conn:
+                    touch_stmt      = await conn.prepare('UPDATE users SET last_seen = NOW() WHERE user_id = ANY($1::bigint[])')
+                    deactivate_stmt = await conn.prepare('UPDATE users SET is_active = FALSE WHERE user_id = ANY($1::bigint[])')
+                    for i in range(0, len(notified), NOTIFY_UPDATE_CHUNK):
+                        await touch_stmt.fetch(notified[i:i + NOTIFY_UPDATE_CHUNK])
+                    for i in range(0, len(blocked), NOTIFY_UPDATE_CHUNK):
+                        await deactivate_stmt.fetch(blocked[i:i + NOTIFY_UPDATE_CHUNK])
+        except Exception as e:
+            logger.error(f"Notify job error: {e}")
@@ -1,23 +1,75 @@
 import asyncio
+import sys
 from aiogram import types, F  
-from aiogram.filters import CommandStart
+from aiogram.types import BotCommand, BotCommandScopeDefault, BotCommandScopeChat
+from aiogram.filters import CommandStart, BaseFilter
 from aiogram.methods import DeleteWebhook
 from loader import dp, bot, logger
-from database import create_db_pool, create_users_table
+from database import (
+    create_db_pool, create_users_table, close_db_pool,
+    activity_flusher, flush_activity_queue, user_seen_flusher,
+)
 import database
 import admin as admin_module
 from helpers import ensure_pin_column, notify_inactive_users
 from handlers_messages import handle_start, handle_text, handle_photo, handle_document, handle_voice 
 from handlers_callbacks import handle_retry_callback
-from utils.history import init_db
+from utils.history import init_db, history_writer, flush_history_queue
 from memory import start_cleanup_task
+from services import create_http_session, close_http_session
+
+class CachedIsNotAdminFilter(BaseFilter):
+    """Admin keshidan sinxron o'qiydi; DB ga faqat kesh bo'sh bo'lsa murojaat qiladi."""
+
+    async def __call__(self, message: types.Message) -> bool:
+        user_id = message.from_user.id
+        flag = database.peek_admin_cache(user_id)
+        if flag is None:
+            try:
+                flag = await database.is_admin_cached(user_id)
+            except Exception:
+                return False
+        return not flag
+
+POLLING_TIMEOUT = 30
+# Bir vaqtda ishlanadigan update lar soni — portlashda tasklar (va xotira) cheksiz o'smaydi
+POLLING_TASKS_LIMIT = 100
+
+USER_COMMANDS = [
+    BotCommand(command="start", description="Botni ishga tushirish"),
+    BotCommand(command="new", description="Yangi suhbat (xotirani tozalash)"),
+]
+ADMIN_COMMANDS = USER_COMMANDS + [
+    BotCommand(command="notify_inactive_now", description="Nofaol userlarga eslatma yuborish"),
+]
+
+async def _sync_commands(commands, scope):
+    """Telegram dagi ro'yxat o'zgargan bo'lsagina set_my_commands chaqiriladi."""
+    if await bot.get_my_commands(scope=scope) != commands:
+        await bot.set_my_commands(commands, scope=scope)
+
+async def set_bot_commands():
+    try:
+        await _sync_commands(USER_COMMANDS, BotCommandScopeDefault())
+        admin_ids = {a['user_id'] for a in await database.get_admins()}
+        superadmin_id = await database.get_superadmin_id()
+        if superadmin_id:
+            admin_ids.add(superadmin_id)
+        for admin_id in admin_ids:
+            await _sync_commands(ADMIN_COMMANDS, BotCommandScopeChat(chat_id=admin_id))
+    except Exception as e:
+        logger.warning(f"Bot buyruqlarini o'rnatib bo'lmadi: {e}")
 
 async def main():
+    await create_http_session()
     await create_db_pool()
     await create_users_table()
     await ensure_pin_column()
     await init_db()
     asyncio.create_task(start_cleanup_task())
+    flusher_task = asyncio.create_task(activity_flusher())
+    seen_task    = asyncio.create_task(user_seen_flusher())
+    history_task = asyncio.create_task(history_writer())
     try:
         import utils.history as uh
         if hasattr(uh, "create_history_table"):
@@ -27,24 +79,59 @@ async def main():
     except Exception as e:
         logger.debug(f"History table create error: {e}")
 
+    # Umumiy HTTP sessiya polling to'xtaganda aiogram shutdown hook ida yopiladi;
+    # finally dagi chaqiruv polling boshlanmagan yoki sessiya qayta ochilgan holatlar uchun
+    dp.shutdown.register(close_http_session)
+
     admin_module.register_admin_handlers(dp, bot, database)
 
-    async def non_admin_predicate(message: types.Message):
-        try:
-            return not await database.is_admin(message.from_user.id)
-        except:
-            return False
+    non_admin = CachedIsNotAdminFilter()
 
     dp.message.register(handle_start, CommandStart())
-    dp.message.register(handle_text, F.text, non_admin_predicate)
-    dp.message.register(handle_photo, F.photo, non_admin_predicate)
-    dp.message.register(handle_document, F.document, non_admin_predicate) 
-    dp.message.register(handle_voice, F.voice, non_admin_predicate)
+    dp.message.register(handle_text, F.text, non_admin)
+    dp.message.register(handle_photo, F.photo, non_admin)
+    dp.message.register(handle_document, F.document, non_admin) 
+    dp.message.register(handle_voice, F.voice, non_admin)
     dp.callback_query.register(handle_retry_callback, lambda q: q.data and q.data.startswith("retry:"))
     asyncio.create_task(notify_inactive_users())
 
-    await bot(DeleteWebhook(drop_pending_updates=True))
-    await dp.start_polling(bot)
+    try:
+        await bot(DeleteWebhook(drop_pending_updates=True))
+        await set_bot_commands()
+        await dp.start_polling(
+            bot,
+            polling_timeout=POLLING_TIMEOUT,
+            handle_as_tasks=True,
+            tasks_concurrency_limit=POLLING_TASKS_LIMIT,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    finally:
+        flusher_task.cancel()
+        seen_task.cancel()
+        # Bekor qilingan tasklar to'xtaguncha kutiladi — so'ng qolganlar yoziladi
+        await asyncio.gather(flusher_task, seen_task, return_exceptions=True)
+        try:
+            await flush_activity_queue()
+        except Exception as e:
+            logger.error(f"Activity flush on shutdown failed: {e}")
+        history_task.cancel()
+        await asyncio.gather(history_task, return_exceptions=True)
+        try:
+            await flush_history_queue()
+        except Exception as e:
+            logger.error(f"History flush on shutdown failed: {e}")
+        await close_http_session()
+        await close_db_pool()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    uvloop = None
+    if sys.platform != "win32":
+        try:
+            import uvloop
+        except ImportError:
+            logger.info("uvloop o'rnatilmagan, standart event loop ishlatiladi")
+    if uvloop is not None:
+        # uvloop.install() Python 3.12+ da eskirgan — loop uvloop.run() orqali yaratiladi
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
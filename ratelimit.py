@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+
+class AsyncTokenBucket:
+    """Token bucket: sekundiga `rate` ta token, `capacity` tagacha portlash (burst)ga ruxsat beradi."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate     = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens  = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock    = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens  = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def penalize(self, seconds: float):
+        """RetryAfter kelganda barcha iste'molchilarni kamida `seconds` ga to'xtatadi (jarimalar qo'shilib ketmaydi)."""
+        self._refill()
+        self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+BULK_SEND_RPS = 28
+
+# Broadcast va notify joblari uchun bitta umumiy bucket: bir vaqtda ishlasa ham jami ~30 msg/s chegarasidan oshmaydi
+bulk_send_bucket = AsyncTokenBucket(rate=BULK_SEND_RPS, capacity=BULK_SEND_RPS)
@@ -6,13 +6,17 @@ import edge_tts
 import inspect
 import asyncio
 import aiohttp
+from aiohttp.payload import BytesPayload
 import re
 import logging
 import base64 
-import json   
+import orjson
 import random
+import time
+import hashlib
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional, Tuple, Union
 import matplotlib.pyplot as plt
 from io import BytesIO
 
@@ -47,6 +51,44 @@ from openai import AsyncOpenAI
 from loader import openai_client, logger
 from utils.history import update_chat_history
 
+http_session: Optional[aiohttp.ClientSession] = None
+UZ_TZ = timezone(timedelta(hours=5))
+HTTP_DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=10)
+
+
+async def create_http_session() -> aiohttp.ClientSession:
+    """OCR va veb-sahifalar uchun umumiy aiohttp sessiyasini yaratadi (main.py da bir marta)."""
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=200,
+                limit_per_host=64,
+                ttl_dns_cache=300,
+                keepalive_timeout=75,
+                enable_cleanup_closed=True,
+                happy_eyeballs_delay=0.25,
+            ),
+            connector_owner=True,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            timeout=HTTP_DEFAULT_TIMEOUT,
+        )
+    return http_session
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """Umumiy sessiyani qaytaradi; startupdan oldin chaqirilsa, uni shu yerda yaratadi."""
+    if http_session is not None and not http_session.closed:
+        return http_session
+    return await create_http_session()
+
+
+async def close_http_session():
+    global http_session
+    if http_session is not None:
+        await http_session.close()
+        http_session = None
+
 
 async def clear_chat_history(chat_id: int):
     try:
@@ -198,6 +240,23 @@ async def search_web(query: str, max_results: int = 6) -> str:
         return "Internetdan qidirishda xatolik yuz berdi."
 
 
+_RE_SKIP_BLOCKS = re.compile(
+    r"<(script|style|nav|footer|header)[^>]*>.*?</\1>", re.DOTALL | re.IGNORECASE
+)
+_RE_TAGS     = re.compile(r"<[^>]+>")
+_RE_ENTITIES = re.compile(r"&(?:[a-zA-Z]{2,6}|#\d+);")
+_RE_SPACES   = re.compile(r"\s{2,}")
+
+
+def _html_to_text(html: str, max_chars: int) -> str:
+    """HTML dan script/style/nav/footer/header bloklari va teglarni olib tashlaydi."""
+    html  = _RE_SKIP_BLOCKS.sub(" ", html)
+    clean = _RE_TAGS.sub(" ", html)
+    clean = _RE_ENTITIES.sub(" ", clean)
+    clean = _RE_SPACES.sub(" ", clean).strip()
+    return clean[:max_chars]
+
+
 async def fetch_page_content(url: str, max_chars: int = 4000) -> str:
     """
     Berilgan URL dan sahifaning to'liq matnini yuklaydi va
@@ -213,26 +272,16 @@ async def fetch_page_content(url: str, max_chars: int = 4000) -> str:
             ),
             "Accept-Language": "uz,ru;q=0.9,en;q=0.8",
         }
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url, headers=headers, ssl=False) as resp:
-                if resp.status != 200:
-                    return ""
-                ct = resp.headers.get("Content-Type", "")
-                if "text/html" not in ct and "text/plain" not in ct:
-                    return ""
-                html = await resp.text(errors="ignore")
-
-                html = re.sub(r"<script[^>]*>.*?</script>", " ", html, flags=re.DOTALL | re.IGNORECASE)
-                html = re.sub(r"<style[^>]*>.*?</style>",  " ", html, flags=re.DOTALL | re.IGNORECASE)
-                html = re.sub(r"<nav[^>]*>.*?</nav>",       " ", html, flags=re.DOTALL | re.IGNORECASE)
-                html = re.sub(r"<footer[^>]*>.*?</footer>", " ", html, flags=re.DOTALL | re.IGNORECASE)
-                html = re.sub(r"<header[^>]*>.*?</header>", " ", html, flags=re.DOTALL | re.IGNORECASE)
-                clean = re.sub(r"<[^>]+>", " ", html)
-                clean = re.sub(r"&[a-zA-Z]{2,6};", " ", clean)
-                clean = re.sub(r"&#\d+;", " ", clean)
-                clean = re.sub(r"\s{2,}", " ", clean).strip()
-
-                return clean[:max_chars]
+        session = await get_http_session()
+        async with session.get(url, headers=headers, ssl=False, timeout=timeout) as resp:
+            if resp.status != 200:
+                return ""
+            ct = resp.headers.get("Content-Type", "")
+            if "text/html" not in ct and "text/plain" not in ct:
+                return ""
+            html = await resp.text(errors="ignore")
+
+        return await asyncio.to_thread(_html_to_text, html, max_chars)
 
     except asyncio.TimeoutError:
         logger.debug(f"fetch_page_content timeout: {url}")
@@ -330,7 +379,59 @@ def extract_text_from_document(file_bytes: bytes, file_name: str) -> str:
     return text[:15000]
 
 
-async def get_vision_reply(chat_id: int, base64_image: str, user_message: str):
+STREAM_COALESCE_WINDOW = 0.5
+STREAM_COALESCE_CHARS  = 400
+_STREAM_MARKERS        = ("[CLEAR_TEXT]", "[STATUS]")
+
+
+async def _coalesce(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Mayda bo'laklarni ~0.5 s yoki 400 belgi oynasida birlashtiradi; birinchi bo'lak darhol chiqadi."""
+    now_fn = asyncio.get_running_loop().time
+    buf: List[str] = []
+    size = 0
+    last = 0.0
+    async for chunk in chunks:
+        if chunk.startswith(_STREAM_MARKERS):
+            # Boshqaruv belgilari handlerda alohida bo'lak sifatida tekshiriladi
+            if buf:
+                yield "".join(buf)
+                buf.clear()
+                size = 0
+            yield chunk
+            last = now_fn()
+            continue
+        buf.append(chunk)
+        size += len(chunk)
+        now = now_fn()
+        if now - last >= STREAM_COALESCE_WINDOW or size >= STREAM_COALESCE_CHARS:
+            yield "".join(buf)
+            buf.clear()
+            size = 0
+            last = now
+    if buf:
+        yield "".join(buf)
+
+
+async def _content_deltas(response) -> AsyncIterator[str]:
+    async for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def _image_data_url(image: Union[bytes, memoryview, BytesIO]) -> str:
+    """Rasm buferidan data URL ni bir marta yasaydi (oraliq base64 satr saqlanmaydi)."""
+    if isinstance(image, BytesIO):
+        with image.getbuffer() as view:
+            encoded = base64.b64encode(view)
+    else:
+        encoded = base64.b64encode(image)
+    return "data:image/jpeg;base64," + encoded.decode("ascii")
+
+
+async def get_vision_reply(chat_id: int, image: Union[bytes, memoryview, BytesIO], user_message: str):
+    image_url = _image_data_url(image)
+    # Oqim davomida xom bufer xotirada ushlab turilmaydi
+    image = None
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT},
         {
@@ -340,7 +441,7 @@ async def get_vision_reply(chat_id: int, base64_image: str, user_message: str):
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}",
+                        "url": image_url,
                         "detail": "auto" 
                     }
                 }
@@ -354,9 +455,8 @@ async def get_vision_reply(chat_id: int, base64_image: str, user_message: str):
             max_tokens=GPT_MAX_TOKENS,
             stream=True
         )
-        async for chunk in response:
-            if chunk.choices and chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
+        async for text in _coalesce(_content_deltas(response)):
+            yield text
     except Exception as e:
         logger.error(f"Vision API xatosi: {e}")
         yield "Rasmni tahlil qilishda xatolik yuz berdi."
@@ -440,6 +540,10 @@ _SYNTHESIS_SYSTEM = """QAT'IY BUYRUQ — ANIQ VA CHUQUR JAVOB YOZ:
 5. SANA/VAQT: Agar ma'lumot eskirgan bo'lsa yoki aniq sana topilmasa — buni ham ayt."""
 
 
+GPT_ERROR_TEXT = "Xatolik yuz berdi. Iltimos qaytadan urinib ko'ring."
+GPT_SYNTHESIS_ERROR_TEXT = "Javob tayyorlashda xatolik yuz berdi. Iltimos qaytadan urinib ko'ring."
+
+
 async def get_openai_reply(
     chat_id: int,
     message_text: str,
@@ -455,7 +559,7 @@ async def get_openai_reply(
 
     try:
         now_utc = datetime.now(timezone.utc)
-        now_tashkent = now_utc.astimezone(timezone(timedelta(hours=5)))
+        now_tashkent = now_utc.astimezone(UZ_TZ)
         time_msg = (
             f"[TIZIM MA'LUMOTI]\n"
             f"Hozirgi sana: {now_tashkent.strftime('%Y-%m-%d')}, "
@@ -485,40 +589,61 @@ async def get_openai_reply(
     search_performed = False
 
     while tool_round < MAX_TOOL_ROUNDS:
+        # Birinchi raund ham oqimli: asbob kerak bo'lmasa, shu javob yakuniy bo'ladi
+        tool_calls: Dict[int, Dict[str, str]] = {}
+        answered = False
         try:
-            response = await openai_client.chat.completions.create(
+            stream = await openai_client.chat.completions.create(
                 model=model,
                 messages=messages,
                 temperature=temperature,
-                max_tokens=512,          
+                max_tokens=max_tokens,
                 top_p=top_p,
                 frequency_penalty=frequency_penalty,
                 presence_penalty=presence_penalty,
                 tools=_TOOLS,
                 tool_choice="auto",
-                stream=False,           
+                stream=True,
             )
+            async with stream:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if delta.tool_calls:
+                        for tc_delta in delta.tool_calls:
+                            slot = tool_calls.setdefault(
+                                tc_delta.index, {"id": "", "name": "", "arguments": ""}
+                            )
+                            if tc_delta.id:
+                                slot["id"] = tc_delta.id
+                            if tc_delta.function:
+                                if tc_delta.function.name:
+                                    slot["name"] = tc_delta.function.name
+                                if tc_delta.function.arguments:
+                                    slot["arguments"] += tc_delta.function.arguments
+                    elif delta.content:
+                        if search_performed:
+                            # Qidiruvdan keyingi javob sintez promptida qayta yoziladi
+                            break
+                        answered = True
+                        yield delta.content
         except Exception as e:
             logger.error(f"GPT tool-detection xatosi: {e}")
-            yield "Xatolik yuz berdi. Iltimos qaytadan urinib ko'ring."
+            yield GPT_ERROR_TEXT
             return
 
-        choice = response.choices[0]
-        finish_reason = choice.finish_reason
-
-        if finish_reason != "tool_calls":
-            break
-
-        tool_calls = choice.message.tool_calls
         if not tool_calls:
+            if answered:
+                return
             break
 
-        tc = tool_calls[0]
-        tool_name = tc.function.name
-        tool_call_id = tc.id
+        tc = tool_calls[min(tool_calls)]
+        tool_name = tc["name"]
+        tool_call_id = tc["id"]
 
         try:
-            args = json.loads(tc.function.arguments)
+            args = orjson.loads(tc["arguments"])
         except Exception:
             args = {}
 
@@ -526,6 +651,8 @@ async def get_openai_reply(
         extra_queries  = args.get("extra_queries", [])
 
         if not primary_query:
+            if answered:
+                return
             break
 
         if not search_performed:
@@ -550,7 +677,7 @@ async def get_openai_reply(
                     "type": "function",
                     "function": {
                         "name": tool_name,
-                        "arguments": tc.function.arguments,
+                        "arguments": tc["arguments"],
                     },
                 }
             ],
@@ -584,33 +711,156 @@ async def get_openai_reply(
 
     except Exception as e:
         logger.error(f"GPT Final synthesis xatosi: {e}")
-        yield "Javob tayyorlashda xatolik yuz berdi. Iltimos qaytadan urinib ko'ring."
+        yield GPT_SYNTHESIS_ERROR_TEXT
+
+
+REPLY_CACHE_SIZE = 1000
+# Tizim xabaridagi sana/vaqt daqiqagacha aniq — kalit shu daqiqaga bog'lanadi, TTL ham shunga teng
+REPLY_CACHE_TTL  = 60
+_reply_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+
+def _prompt_key(text: str) -> str:
+    """Savol + Toshkent vaqti (daqiqa): "soat nechi?" kabi javoblar boshqa daqiqada qayta berilmaydi."""
+    stamp = datetime.now(UZ_TZ).strftime('%Y-%m-%d %H:%M')
+    normalized = " ".join(text.lower().split())
+    return hashlib.blake2b(f"{stamp}\n{normalized}".encode(), digest_size=16).hexdigest()
+
+
+def _reply_cache_get(key: str) -> Optional[str]:
+    entry = _reply_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, reply = entry
+    if expires_at < time.monotonic():
+        del _reply_cache[key]
+        return None
+    _reply_cache.move_to_end(key)
+    return reply
+
+
+def _reply_cache_put(key: str, reply: str):
+    _reply_cache[key] = (time.monotonic() + REPLY_CACHE_TTL, reply)
+    _reply_cache.move_to_end(key)
+    if len(_reply_cache) > REPLY_CACHE_SIZE:
+        _reply_cache.popitem(last=False)
+
 
+async def _replay(reply: str) -> AsyncIterator[str]:
+    yield reply
 
-async def get_gpt_reply(chat_id: int, user_message: str):
-    async for chunk in get_openai_reply(chat_id, user_message):
+
+async def _caching_stream(key: str, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Oqimni o'zgartirmasdan uzatadi; qidiruvsiz va xatosiz javobni keshga yozadi."""
+    parts: List[str] = []
+    cacheable = True
+    async for chunk in chunks:
+        if chunk.startswith(_STREAM_MARKERS) or "[CLEAR_TEXT]" in chunk:
+            # Internet qidiruvi natijasi vaqtga bog'liq — keshlanmaydi
+            cacheable = False
+        parts.append(chunk)
         yield chunk
+    reply = "".join(parts).strip()
+    if cacheable and reply and GPT_ERROR_TEXT not in reply and GPT_SYNTHESIS_ERROR_TEXT not in reply:
+        _reply_cache_put(key, reply)
+
+
+def get_gpt_reply(chat_id: int, user_message: str, cacheable: bool = False) -> AsyncIterator[str]:
+    """
+    Oqimni to'g'ridan-to'g'ri qaytaradi — qo'shimcha generator qatlami yo'q.
+    cacheable=True (yangi suhbat, tarix yo'q) bo'lsa, bir xil savolga keshdagi javob darhol qaytadi.
+    """
+    if not cacheable:
+        return _coalesce(get_openai_reply(chat_id, user_message))
+    key = _prompt_key(user_message)
+    cached = _reply_cache_get(key)
+    if cached is not None:
+        return _replay(cached)
+    return _caching_stream(key, _coalesce(get_openai_reply(chat_id, user_message)))
+
+
+
+OCR_CACHE_SIZE = 5000
+OCR_CACHE_TTL  = 7 * 24 * 3600
+_ocr_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+
+def _image_key(image_bytes: Union[bytes, memoryview]) -> str:
+    return hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+
+def _ocr_cache_get(key: str) -> Optional[str]:
+    entry = _ocr_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, text = entry
+    if expires_at < time.monotonic():
+        del _ocr_cache[key]
+        return None
+    _ocr_cache.move_to_end(key)
+    return text
+
+
+async def extract_text_from_image(image_bytes: Union[bytes, memoryview, BytesIO]) -> str:
+    if isinstance(image_bytes, BytesIO):
+        # bot.download_file natijasi: nusxa olmasdan bufer ko'rinishi ishlatiladi
+        image_bytes = image_bytes.getbuffer()
+    key = _image_key(image_bytes)
+    cached = _ocr_cache_get(key)
+    if cached is not None:
+        return cached
+
+    text = await _ocr_space_request(image_bytes)
+    _ocr_cache_put(key, text)
+    return text
+
+
+def _ocr_cache_put(key: str, text: str):
+    if text:
+        _ocr_cache[key] = (time.monotonic() + OCR_CACHE_TTL, text)
+        _ocr_cache.move_to_end(key)
+        if len(_ocr_cache) > OCR_CACHE_SIZE:
+            _ocr_cache.popitem(last=False)
 
 
+_OCR_URL = "https://api.ocr.space/parse/image"
+_OCR_HEADERS = {"apikey": OCR_API_KEY or ""}
+_OCR_FIELDS = (("language", "eng"), ("isOverlayRequired", "false"))
+OCR_TIMEOUT = 15
+OCR_PARSE_OFFLOAD_BYTES = 256 * 1024
+_OCR_TIMEOUT = aiohttp.ClientTimeout(total=OCR_TIMEOUT, connect=5)
 
-async def extract_text_from_image(image_bytes: bytes) -> str:
-    url = "https://api.ocr.space/parse/image"
-    headers = {"apikey": OCR_API_KEY}
-    data = {"language": "eng", "isOverlayRequired": False}
+
+def _ocr_form(image_bytes: Union[bytes, memoryview]) -> aiohttp.FormData:
+    form = aiohttp.FormData(_OCR_FIELDS)
+    form.add_field("file", BytesPayload(image_bytes, content_type="image/jpeg"), filename="image.jpg")
+    return form
+
+
+async def _ocr_space_request(image_bytes: Union[bytes, memoryview]) -> str:
     try:
-        async with aiohttp.ClientSession() as session:
-            form = aiohttp.FormData()
-            form.add_field("file", image_bytes, filename="image.jpg", content_type="image/jpeg")
-            for key, val in data.items():
-                form.add_field(key, str(val))
-            async with session.post(url, data=form, headers=headers) as resp:
-                result = await resp.json()
-                return result.get("ParsedResults", [{}])[0].get("ParsedText", "").strip()
+        session = await get_http_session()
+        async with session.post(
+            _OCR_URL, data=_ocr_form(image_bytes), headers=_OCR_HEADERS, timeout=_OCR_TIMEOUT
+        ) as resp:
+            raw = await resp.read()
+            # Kichik javob loopda tezroq; katta (ko'p sahifali/overlay) javob alohida oqimda
+            if len(raw) > OCR_PARSE_OFFLOAD_BYTES:
+                result = await asyncio.to_thread(orjson.loads, raw)
+            else:
+                result = orjson.loads(raw)
+            pr = result.get("ParsedResults")
+            return pr[0].get("ParsedText", "").strip() if pr else ""
     except Exception as e:
         logger.error(f"OCR xatosi: {str(e)}")
         return ""
 
 async def speech_to_text(file_path: str) -> str:
+    """ffmpeg konvertatsiyasi va Google so'rovi bloklovchi — alohida oqimda bajariladi."""
+    return await asyncio.to_thread(_speech_to_text_sync, file_path)
+
+
+def _speech_to_text_sync(file_path: str) -> str:
     r = sr.Recognizer()
     wav_path = file_path + ".wav"
     try:
@@ -661,15 +911,17 @@ def render_latex_to_image(formula: str) -> BytesIO:
         logger.error(f"LaTeX render error: {e}")
         return None
 
+IMAGE_TIMEOUT = aiohttp.ClientTimeout(total=60, connect=5)
+
 async def generate_image(prompt: str) -> bytes:
     try:
         safe_prompt = prompt.replace(" ", "%20")
         seed = random.randint(1, 10000)
         url = f"https://image.pollinations.ai/prompt/{safe_prompt}?seed={seed}&nologo=true"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    return await response.read()
-                return None
+        session = await get_http_session()
+        async with session.get(url, timeout=IMAGE_TIMEOUT) as response:
+            if response.status == 200:
+                return await response.read()
+            return None
     except Exception:
         return None
@@ -1,7 +1,8 @@
-<<<<<<< HEAD
 import asyncio
+import logging
 import aiosqlite
-from typing import List, Dict
+from collections import OrderedDict, deque
+from typing import Deque, List, Dict, Optional, Tuple
 
 # --------------------------------------------------
 # KONFIGURATSIYA
@@ -12,9 +13,27 @@ except ImportError:
     SYSTEM_PROMPT   = "Siz foydali yordamchisiz."
     CONTEXT_WINDOW  = 12
 
-DB_PATH = "chat_history.db"
+logger = logging.getLogger(__name__)
 
-_cache: Dict[int, List[Dict]] = {}
+DB_PATH = "chat_history.db"
+MAX_CACHED_CHATS = 10000
+HISTORY_FLUSH_ROWS = 200
+HISTORY_FLUSH_DELAY = 2.0
+
+_cache: "OrderedDict[int, Deque[Dict]]" = OrderedDict()
+# ("add", chat_id, role, content) yoki ("clear", chat_id, None, None) — tartib saqlanadi
+_write_queue: "asyncio.Queue[Tuple[str, int, Optional[str], Optional[str]]]" = asyncio.Queue()
+# history_writer bekor qilinganda yozilmay qolgan partiya
+_interrupted_ops: List[Tuple[str, int, Optional[str], Optional[str]]] = []
+
+def _cache_set(chat_id: int, history: List[Dict]) -> Deque[Dict]:
+    """Eng uzoq ishlatilmagan chatlarni keshdan chiqaradi (MAX_CACHED_CHATS)."""
+    window = deque(history, maxlen=CONTEXT_WINDOW)
+    _cache[chat_id] = window
+    _cache.move_to_end(chat_id)
+    while len(_cache) > MAX_CACHED_CHATS:
+        _cache.popitem(last=False)
+    return window
 
 # --------------------------------------------------
 # DB INITSIALIZATSIYA — main.py da bir marta chaqiriladi
@@ -31,51 +50,118 @@ async def init_db():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
+        # (chat_id, id): oxirgi N ta xabarni o'qish va kesish indeksning o'zida bajariladi
         await db.execute(
-            "CREATE INDEX IF NOT EXISTS idx_chat_id ON messages (chat_id)"
+            "CREATE INDEX IF NOT EXISTS idx_chat_id_id ON messages (chat_id, id)"
         )
+        await db.execute("DROP INDEX IF EXISTS idx_chat_id")
         await db.commit()
 
 # --------------------------------------------------
 # XABAR QO'SHISH
 # --------------------------------------------------
 async def update_chat_history(chat_id: int, content: str, role: str = "user"):
-    """Xabarni keshga va SQLite ga yozadi."""
-    if chat_id not in _cache:
-        _cache[chat_id] = await _load_from_db(chat_id)
-
-    _cache[chat_id].append({"role": role, "content": content})
-
-    if len(_cache[chat_id]) > CONTEXT_WINDOW:
-        _cache[chat_id] = _cache[chat_id][-CONTEXT_WINDOW:]
+    """Xabarni keshdagi deque ga qo'shadi; SQLite ga history_writer() fonda yozadi."""
+    history = _cache.get(chat_id)
+    if history is None:
+        loaded  = await _load_from_db(chat_id)
+        # Yuklash paytida parallel yozuv keshni to'ldirgan bo'lishi mumkin
+        history = _cache.get(chat_id)
+        if history is None:
+            history = _cache_set(chat_id, loaded)
+    else:
+        _cache.move_to_end(chat_id)
+
+    history.append({"role": role, "content": content})
+    _write_queue.put_nowait(("add", chat_id, role, content))
 
+# --------------------------------------------------
+# FONDA YOZISH — main.py da task sifatida ishga tushiriladi
+# --------------------------------------------------
+async def _write_batch(ops: List[Tuple[str, int, Optional[str], Optional[str]]]):
+    """Navbatdagi amallarni tartib bilan bitta ulanishda bajaradi."""
     async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT INTO messages (chat_id, role, content) VALUES (?, ?, ?)",
-            (chat_id, role, content)
-        )
-        await db.execute("""
-            DELETE FROM messages
-            WHERE chat_id = ? AND id NOT IN (
-                SELECT id FROM messages
-                WHERE chat_id = ?
-                ORDER BY id DESC
-                LIMIT ?
+        pending: List[Tuple[int, str, str]] = []
+        touched = set()
+
+        async def _flush_inserts():
+            if not pending:
+                return
+            await db.executemany(
+                "INSERT INTO messages (chat_id, role, content) VALUES (?, ?, ?)", pending
             )
-        """, (chat_id, chat_id, CONTEXT_WINDOW))
+            pending.clear()
+
+        for op, chat_id, role, content in ops:
+            if op == "add":
+                pending.append((chat_id, role, content))
+                touched.add(chat_id)
+            else:
+                await _flush_inserts()
+                await db.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+                touched.discard(chat_id)
+        await _flush_inserts()
+
+        for chat_id in touched:
+            # Oynadan tashqaridagi eng yangi id topiladi va undan eskilari o'chiriladi
+            await db.execute("""
+                DELETE FROM messages
+                WHERE chat_id = ? AND id <= (
+                    SELECT id FROM messages
+                    WHERE chat_id = ?
+                    ORDER BY id DESC
+                    LIMIT 1 OFFSET ?
+                )
+            """, (chat_id, chat_id, CONTEXT_WINDOW))
         await db.commit()
 
+def _drain(first=None) -> List[Tuple[str, int, Optional[str], Optional[str]]]:
+    ops = [first] if first is not None else []
+    while len(ops) < HISTORY_FLUSH_ROWS and not _write_queue.empty():
+        ops.append(_write_queue.get_nowait())
+    return ops
+
+async def history_writer():
+    """Navbatni uzluksiz bo'shatadi: bir partiya — bitta ulanish va bitta commit."""
+    while True:
+        ops = [await _write_queue.get()]
+        try:
+            # Qisqa kutish: user va assistant xabarlari (va parallel chatlar) bitta commitga tushadi
+            if _write_queue.qsize() < HISTORY_FLUSH_ROWS:
+                await asyncio.sleep(HISTORY_FLUSH_DELAY)
+            ops = _drain(ops[0])
+            await _write_batch(ops)
+        except asyncio.CancelledError:
+            # To'xtatilganda navbatdan olingan amallar yo'qolmasin — flush_history_queue() yozadi
+            _interrupted_ops.extend(ops)
+            raise
+        except Exception as e:
+            logger.error(f"History yozishda xatolik ({len(ops)} ta): {e}")
+
+async def flush_history_queue():
+    """Qolgan yozuvlarni saqlaydi (to'xtashda, history_writer bekor qilingandan keyin chaqiriladi)."""
+    if _interrupted_ops:
+        ops = list(_interrupted_ops)
+        _interrupted_ops.clear()
+        await _write_batch(ops)
+    while not _write_queue.empty():
+        await _write_batch(_drain())
+
 # --------------------------------------------------
 # TARIX OLISH
 # --------------------------------------------------
 async def get_chat_history(chat_id: int, limit: int = CONTEXT_WINDOW) -> List[Dict]:
     """Keshdan yoki DBdan tarixni qaytaradi. system prompt ni qo'shmaydi."""
     if chat_id in _cache:
-        return _cache[chat_id][-limit:]
+        _cache.move_to_end(chat_id)
+        return list(_cache[chat_id])[-limit:]
 
-    history = await _load_from_db(chat_id, limit)
-    _cache[chat_id] = history
-    return history
+    # Kesh har doim to'liq oyna bilan to'ldiriladi — kichik `limit` keyingi o'qishlarni qisqartirmasin
+    history = await _load_from_db(chat_id)
+    if chat_id in _cache:
+        return list(_cache[chat_id])[-limit:]
+    _cache_set(chat_id, history)
+    return history[-limit:]
 
 async def _load_from_db(chat_id: int, limit: int = CONTEXT_WINDOW) -> List[Dict]:
     """DBdan so'nggi `limit` ta xabarni yuklaydi."""
@@ -93,27 +179,10 @@ async def _load_from_db(chat_id: int, limit: int = CONTEXT_WINDOW) -> List[Dict]
 # TARIXNI TOZALASH
 # --------------------------------------------------
 async def clear_history(chat_id: int):
-    """Kesh va DBdan chat tarixini to'liq o'chiradi."""
-    _cache.pop(chat_id, None)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
-        await db.commit()
+    """Kesh va DBdan chat tarixini to'liq o'chiradi (fondagi yozuvlardan keyin)."""
+    # Bo'sh oyna: DB dagi eski yozuvlar o'chirilguncha qayta yuklanmaydi
+    _cache_set(chat_id, [])
+    _write_queue.put_nowait(("clear", chat_id, None, None))
 
 async def clear_user_history(chat_id: int):
     await clear_history(chat_id)
-=======
-from datetime import datetime
-
-chat_history = {}
-user_last_activity = {}
-
-def update_chat_history(chat_id: int, content: str, role: str = "user"):
-    if chat_id not in chat_history:
-        chat_history[chat_id] = [{"role": "system", "content": "Siz foydali yordamchisiz."}]
-    chat_history[chat_id].append({"role": role, "content": content})
-    chat_history[chat_id] = [chat_history[chat_id][0]] + chat_history[chat_id][-9:]
-
-def clear_user_history(chat_id: int):
-    if chat_id in chat_history:
-        chat_history[chat_id] = [chat_history[chat_id][0]]
->>>>>>> d525665592d98036647d88bec8ad24f9f234c742